@@ -0,0 +1,162 @@
+import multiprocessing
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+from pipeline_stats import PipelineStats
+from shm_ring import DEFAULT_CAPACITY, RingQueue
+
+
+@dataclass
+class Stage:
+    name: str
+    func: Callable
+    workers: int = 1
+
+
+def stage_worker(name, func, input_queue, output_queue):
+    while True:
+        item = input_queue.get()
+        if item is None:
+            break
+
+        enter = time.monotonic()
+        seq, messages, errors, trace = item
+        results = []
+        for i, message in enumerate(messages):
+            if errors and i in errors:
+                results.append(message)
+                continue
+            try:
+                results.append(func(message))
+            except Exception as e:
+                errors = dict(errors or {})
+                errors[i] = f"{name}: {e}"
+                results.append(None)
+                print(f"Ошибка в стадии {name}: {e}", file=sys.stderr)
+        trace.append(enter)
+        trace.append(time.monotonic())
+        output_queue.put((seq, results, errors, trace))
+
+
+class Pipeline:
+    def __init__(self, stages, queue_size=100, ordered=True, transport="queue", ring_capacity=DEFAULT_CAPACITY,
+                 stats_output=None, stats_interval=None):
+        self.stages = stages
+        self.ordered = ordered
+        self.transport = transport
+        if transport == "queue":
+            self.queues = [multiprocessing.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+        elif transport == "shm":
+            if any(stage.workers != 1 for stage in stages):
+                raise ValueError("Транспорт shm поддерживает только один процесс на стадию")
+            self.queues = [RingQueue(ring_capacity) for _ in range(len(stages) + 1)]
+        else:
+            raise ValueError(f"Неизвестный транспорт: {transport}")
+        self.stats = None
+        if stats_interval:
+            names = [stage.name for stage in stages]
+            self.stats = PipelineStats(
+                names,
+                [f"{src}->{dst}" for src, dst in zip(["input"] + names, names + ["output"])],
+                output=stats_output,
+                interval=stats_interval
+            )
+        self.processes = []
+        self._next_seq = 0
+        self._shutdown_thread = None
+
+    @property
+    def input_queue(self):
+        return self.queues[0]
+
+    @property
+    def output_queue(self):
+        return self.queues[-1]
+
+    def start(self):
+        for i, stage in enumerate(self.stages):
+            workers = []
+            for j in range(stage.workers):
+                process = multiprocessing.Process(
+                    target=stage_worker,
+                    args=(stage.name, stage.func, self.queues[i], self.queues[i + 1]),
+                    name=f"{stage.name}-{j}",
+                    daemon=True
+                )
+                process.start()
+                workers.append(process)
+            self.processes.append(workers)
+        if self.stats is not None:
+            self.stats.start(self.queues)
+        return self
+
+    def put(self, message):
+        self.put_batch([message])
+
+    def put_batch(self, messages):
+        self.input_queue.put((self._next_seq, list(messages), None, [time.monotonic()]))
+        self._next_seq += 1
+
+    def close(self):
+        for _ in range(self.stages[0].workers):
+            self.input_queue.put(None)
+        self._shutdown_thread = threading.Thread(target=self._propagate_shutdown, daemon=True)
+        self._shutdown_thread.start()
+
+    def _propagate_shutdown(self):
+        # Стадия i+1 получает столько сентинелов, сколько у нее воркеров,
+        # только после завершения всех воркеров стадии i, поэтому сентинел
+        # не может обогнать результаты, еще не вытолкнутые в очередь
+        for i, workers in enumerate(self.processes):
+            for process in workers:
+                process.join()
+            next_workers = self.stages[i + 1].workers if i + 1 < len(self.stages) else 1
+            for _ in range(next_workers):
+                self.queues[i + 1].put(None)
+
+    def results(self):
+        for _, messages, errors in self.batches():
+            for i, message in enumerate(messages):
+                yield message, errors.get(i) if errors else None
+
+    def batches(self):
+        pending = {}
+        expected = 0
+        while True:
+            item = self.output_queue.get()
+            if item is None:
+                break
+
+            seq, messages, errors, trace = item
+            if self.stats is not None:
+                self.stats.record(trace, len(messages))
+            item = seq, messages, errors
+
+            if not self.ordered:
+                yield item
+                continue
+
+            pending[item[0]] = item
+            while expected in pending:
+                yield pending.pop(expected)
+                expected += 1
+
+        for seq in sorted(pending):
+            yield pending[seq]
+
+    def join(self, timeout=None):
+        if self._shutdown_thread is not None:
+            self._shutdown_thread.join(timeout)
+        for workers in self.processes:
+            for process in workers:
+                process.join(timeout)
+                if process.is_alive():
+                    process.terminate()
+        if self.stats is not None:
+            self.stats.stop()
+        if self.transport == "shm":
+            for channel in self.queues:
+                channel.close()
@@ -0,0 +1,134 @@
+import math
+import sys
+import threading
+import time
+
+
+class LatencyHistogram:
+    """Гистограмма с логарифмическими корзинами: 8 корзин на каждое удвоение, от 1 мкс."""
+
+    MIN_VALUE = 1e-6
+    BUCKETS_PER_OCTAVE = 8
+    N_BUCKETS = 8 * 40
+
+    def __init__(self):
+        self.counts = [0] * self.N_BUCKETS
+        self.total = 0
+        self.max_value = 0.0
+
+    def record(self, value, count=1):
+        if value <= self.MIN_VALUE:
+            index = 0
+        else:
+            index = min(int(math.log2(value / self.MIN_VALUE) * self.BUCKETS_PER_OCTAVE) + 1, self.N_BUCKETS - 1)
+        self.counts[index] += count
+        self.total += count
+        if value > self.max_value:
+            self.max_value = value
+
+    def percentile(self, p):
+        if self.total == 0:
+            return 0.0
+        target = self.total * p / 100
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                if index == 0:
+                    return self.MIN_VALUE
+                return min(self.MIN_VALUE * 2 ** (index / self.BUCKETS_PER_OCTAVE), self.max_value)
+        return self.max_value
+
+
+class PipelineStats:
+    def __init__(self, stage_names, queue_names, output=None, interval=10.0, sample_interval=0.1):
+        self.stage_names = stage_names
+        self.queue_names = queue_names
+        self.output = output
+        self.interval = interval
+        self.sample_interval = sample_interval
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._reset()
+
+    def _reset(self):
+        self.service = {name: LatencyHistogram() for name in self.stage_names}
+        self.wait = {name: LatencyHistogram() for name in self.stage_names}
+        self.end_to_end = LatencyHistogram()
+        self.depths = {name: [] for name in self.queue_names}
+        self.messages = 0
+        self.window_start = time.monotonic()
+
+    def record(self, trace, count=1):
+        now = time.monotonic()
+        with self.lock:
+            previous = trace[0]
+            for i, name in enumerate(self.stage_names):
+                enter, exit_ = trace[1 + 2 * i], trace[2 + 2 * i]
+                self.wait[name].record(enter - previous, count)
+                # стадия обрабатывает пачку целиком: на сообщение приходится доля ее времени,
+                # а ожидание в очереди и сквозная задержка у каждого сообщения полные
+                self.service[name].record((exit_ - enter) / count, count)
+                previous = exit_
+            self.end_to_end.record(now - trace[0], count)
+            self.messages += count
+
+    def start(self, queues):
+        self._thread = threading.Thread(target=self._run, args=(queues,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self.report()
+
+    def _run(self, queues):
+        next_report = time.monotonic() + self.interval
+        while not self._stop.wait(self.sample_interval):
+            for name, channel in zip(self.queue_names, queues):
+                depth = queue_depth(channel)
+                if depth is not None:
+                    with self.lock:
+                        self.depths[name].append(depth)
+            if time.monotonic() >= next_report:
+                self.report()
+                next_report += self.interval
+
+    def summary(self):
+        with self.lock:
+            elapsed_time = max(time.monotonic() - self.window_start, 1e-9)
+            timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+            lines = [f"[{timestamp}] Сообщений: {self.messages} ({self.messages / elapsed_time:.0f} сообщений/сек)"]
+            for name in self.stage_names:
+                wait, service = self.wait[name], self.service[name]
+                lines.append(
+                    f"  Стадия {name}: ожидание p50={wait.percentile(50) * 1000:.3f} мс p99={wait.percentile(99) * 1000:.3f} мс, "
+                    f"обработка p50={service.percentile(50) * 1000:.3f} мс p99={service.percentile(99) * 1000:.3f} мс"
+                )
+            lines.append(
+                f"  Сквозная задержка: p50={self.end_to_end.percentile(50) * 1000:.3f} мс "
+                f"p99={self.end_to_end.percentile(99) * 1000:.3f} мс"
+            )
+            for name, depths in self.depths.items():
+                if depths:
+                    lines.append(f"  Очередь {name}: средняя глубина={sum(depths) / len(depths):.1f}, максимальная={max(depths)}")
+            self._reset()
+        return "\n".join(lines) + "\n"
+
+    def report(self):
+        text = self.summary()
+        if self.output is None:
+            sys.stderr.write(text)
+            sys.stderr.flush()
+        else:
+            with open(self.output, "a", encoding="utf-8") as f:
+                f.write(text)
+
+
+def queue_depth(channel):
+    try:
+        return channel.qsize()
+    except NotImplementedError:
+        return None
@@ -0,0 +1,196 @@
+import argparse
+import multiprocessing
+import pickle
+import statistics
+import struct
+import time
+from multiprocessing import shared_memory
+
+
+HEADER = struct.Struct("QQ")
+LENGTH = struct.Struct("I")
+DEFAULT_CAPACITY = 1 << 20
+
+
+class RingBuffer:
+    """Кольцевой буфер в разделяемой памяти для одного писателя и одного читателя.
+
+    Записи хранятся как 4 байта длины + данные. Заголовок содержит два
+    монотонно растущих счетчика: сколько байт записано (head) и прочитано (tail).
+    Писатель меняет только head, читатель - только tail, поэтому блокировки
+    не нужны; о новых записях читателю сообщает семафор.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.shm = shared_memory.SharedMemory(create=True, size=HEADER.size + capacity)
+        self.shm.buf[:HEADER.size] = HEADER.pack(0, 0)
+        self.items = multiprocessing.Semaphore(0)
+        self._owner = True
+        self._attach()
+
+    def _attach(self):
+        self.buf = self.shm.buf
+        self.data = self.shm.buf[HEADER.size:]
+
+    def __getstate__(self):
+        return {"capacity": self.capacity, "name": self.shm.name, "items": self.items}
+
+    def __setstate__(self, state):
+        self.capacity = state["capacity"]
+        self.shm = shared_memory.SharedMemory(name=state["name"])
+        self.items = state["items"]
+        self._owner = False
+        self._attach()
+
+    def _head(self):
+        return struct.unpack_from("Q", self.buf, 0)[0]
+
+    def _tail(self):
+        return struct.unpack_from("Q", self.buf, 8)[0]
+
+    def _write(self, pos, payload):
+        offset = pos % self.capacity
+        first = min(len(payload), self.capacity - offset)
+        self.data[offset:offset + first] = payload[:first]
+        if first < len(payload):
+            self.data[:len(payload) - first] = payload[first:]
+
+    def _read(self, pos, size):
+        offset = pos % self.capacity
+        first = min(size, self.capacity - offset)
+        if first == size:
+            return bytes(self.data[offset:offset + size])
+        return bytes(self.data[offset:]) + bytes(self.data[:size - first])
+
+    def put_bytes(self, payload):
+        size = LENGTH.size + len(payload)
+        if size > self.capacity:
+            raise ValueError(f"Запись размером {size} байт не помещается в буфер {self.capacity} байт")
+
+        head = self._head()
+        delay = 0
+        while head + size - self._tail() > self.capacity:
+            time.sleep(delay)
+            delay = min(max(delay * 2, 1e-5), 1e-3)
+
+        self._write(head, LENGTH.pack(len(payload)))
+        self._write(head + LENGTH.size, payload)
+        struct.pack_into("Q", self.buf, 0, head + size)
+        self.items.release()
+
+    def get_bytes(self, timeout=None):
+        if not self.items.acquire(timeout=timeout):
+            raise TimeoutError("Буфер пуст")
+
+        tail = self._tail()
+        (length,) = LENGTH.unpack(self._read(tail, LENGTH.size))
+        payload = self._read(tail + LENGTH.size, length)
+        struct.pack_into("Q", self.buf, 8, tail + LENGTH.size + length)
+        return payload
+
+    def close(self):
+        self.buf = None
+        self.data.release()
+        self.data = None
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
+
+
+class RingQueue(RingBuffer):
+    """Замена multiprocessing.Queue с тем же put/get для стадий конвейера."""
+
+    def put(self, item):
+        self.put_bytes(pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def get(self, timeout=None):
+        return pickle.loads(self.get_bytes(timeout))
+
+    def qsize(self):
+        return self.items.get_value()
+
+
+def _throughput_producer(channel, count, payload):
+    for _ in range(count):
+        channel.put(payload)
+    channel.put(None)
+
+
+def _echo(requests, responses):
+    while True:
+        item = requests.get()
+        responses.put(item)
+        if item is None:
+            break
+
+
+def measure_throughput(channel, count, payload):
+    producer = multiprocessing.Process(target=_throughput_producer, args=(channel, count, payload))
+    start_time = time.perf_counter()
+    producer.start()
+    received = 0
+    while channel.get() is not None:
+        received += 1
+    elapsed_time = time.perf_counter() - start_time
+    producer.join()
+    return received / elapsed_time
+
+
+def measure_latency(requests, responses, count, payload):
+    echo = multiprocessing.Process(target=_echo, args=(requests, responses))
+    echo.start()
+    latencies = []
+    for _ in range(count):
+        start_time = time.perf_counter()
+        requests.put(payload)
+        responses.get()
+        latencies.append((time.perf_counter() - start_time) / 2)
+    requests.put(None)
+    responses.get()
+    echo.join()
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.99)]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Сравнение multiprocessing.Queue и кольцевого буфера в разделяемой памяти"
+    )
+    parser.add_argument("-n", "--count", type=int, default=200000, help="Количество сообщений (по умолчанию: 200000)")
+    parser.add_argument("--size", type=int, default=32, help="Размер сообщения в байтах (по умолчанию: 32)")
+    args = parser.parse_args()
+
+    payload = "x" * args.size
+    latency_count = min(args.count, 10000)
+    results = []
+
+    queue = multiprocessing.Queue(maxsize=1000)
+    throughput = measure_throughput(queue, args.count, payload)
+    p50, p99 = measure_latency(multiprocessing.Queue(), multiprocessing.Queue(), latency_count, payload)
+    results.append(("multiprocessing.Queue", throughput, p50, p99))
+
+    ring = RingQueue()
+    requests, responses = RingQueue(), RingQueue()
+    throughput = measure_throughput(ring, args.count, payload)
+    p50, p99 = measure_latency(requests, responses, latency_count, payload)
+    results.append(("RingQueue (shared_memory)", throughput, p50, p99))
+    for channel in (ring, requests, responses):
+        channel.close()
+
+    with open("artifacts/4_3_transport.txt", "w", encoding="utf-8") as f:
+        f.write("Сравнение транспорта между процессами\n")
+        f.write("=" * 70 + "\n\n")
+        f.write(f"Сообщений: {args.count}, размер сообщения: {args.size} байт\n\n")
+        f.write(f"{'Транспорт':<28} {'Сообщений/сек':<15} {'p50 (мкс)':<12} {'p99 (мкс)':<12}\n")
+        f.write("-" * 70 + "\n")
+        for name, throughput, p50, p99 in results:
+            line = f"{name:<28} {throughput:<15.0f} {p50 * 1e6:<12.1f} {p99 * 1e6:<12.1f}"
+            print(line)
+            f.write(line + "\n")
+
+    print("\nРезультаты сохранены в artifacts/4_3_transport.txt")
+
+
+if __name__ == "__main__":
+    main()
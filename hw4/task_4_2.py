@@ -1,7 +1,14 @@
+import argparse
+import atexit
+import json
 import math
 import time
 import os
+import pickle
+import platform
+import sys
 from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from pathlib import Path
 
 
 def integrate(f, a, b, *, n_jobs=1, n_iter=10000000):
@@ -12,6 +19,23 @@ def integrate(f, a, b, *, n_jobs=1, n_iter=10000000):
     return acc
 
 
+MIN_CHUNK_SIZE = 10000
+TARGET_CHUNKS = 256
+
+EXECUTORS = {
+    "thread": ThreadPoolExecutor,
+    "process": ProcessPoolExecutor,
+}
+AUTOTUNE_CACHE = Path("artifacts/4_2_autotune.json")
+PROBE_N_ITER = 2000000
+PROBE_CHUNK_SIZES = [MIN_CHUNK_SIZE, 50000, 200000]
+
+# пулы для n_jobs="auto" живут до конца процесса и закрываются при выходе
+_auto_executors = {}
+# кэш автотюнинга читается из файла один раз за процесс
+_autotune_caches = {}
+
+
 def integrate_chunk(f, a, b, start_iter, end_iter, n_iter):
     acc = 0
     step = (b - a) / n_iter
@@ -20,29 +44,175 @@ def integrate_chunk(f, a, b, start_iter, end_iter, n_iter):
     return acc
 
 
-def integrate_parallel(f, a, b, *, n_jobs=1, n_iter=10000000, executor_class=None):
+def default_chunk_size(n_iter):
+    return max(MIN_CHUNK_SIZE, -(-n_iter // TARGET_CHUNKS))
+
+
+def split_chunks(n_iter, chunk_size):
+    return [(start, min(start + chunk_size, n_iter)) for start in range(0, n_iter, chunk_size)]
+
+
+def integrate_parallel(f, a, b, *, n_jobs=1, n_iter=10000000, executor_class=None, executor=None, chunk_size=None):
+    if n_jobs == "auto":
+        config = autotune(f)
+        n_jobs = config["n_jobs"]
+        if chunk_size is None:
+            chunk_size = config["chunk_size"]
+        if executor is None and n_jobs > 1:
+            kind = config["executor"]
+            if kind == "process" and not is_picklable(f):
+                kind = "thread"
+            executor = _get_auto_executor(kind, n_jobs)
+    
+    if chunk_size is None:
+        chunk_size = default_chunk_size(n_iter)
+    if chunk_size <= 0:
+        raise ValueError(f"chunk_size должен быть положительным, получено {chunk_size}")
+    chunks = split_chunks(n_iter, chunk_size)
+    
+    if executor is None and n_jobs == 1:
+        return math.fsum(integrate_chunk(f, a, b, start, end, n_iter) for start, end in chunks)
+    
+    if executor is None:
+        with executor_class(max_workers=n_jobs) as executor:
+            return _integrate_chunks(executor, f, a, b, chunks, n_iter)
+    
+    return _integrate_chunks(executor, f, a, b, chunks, n_iter)
+
+
+def _integrate_chunks(executor, f, a, b, chunks, n_iter):
+    futures = [
+        executor.submit(integrate_chunk, f, a, b, start, end, n_iter)
+        for start, end in chunks
+    ]
+    return math.fsum(future.result() for future in futures)
+
+
+def _get_auto_executor(kind, n_jobs):
+    key = (kind, n_jobs)
+    if key not in _auto_executors:
+        _auto_executors[key] = EXECUTORS[kind](max_workers=n_jobs)
+    return _auto_executors[key]
+
+
+def shutdown_auto_executors():
+    for executor in _auto_executors.values():
+        executor.shutdown(wait=True)
+    _auto_executors.clear()
+
+
+atexit.register(shutdown_auto_executors)
+
+
+def is_picklable(f):
+    # лямбды и замыкания нельзя передать в ProcessPoolExecutor
+    try:
+        pickle.dumps(f)
+    except Exception:
+        return False
+    return True
+
+
+def autotune_key(f):
+    module = getattr(f, "__module__", None) or type(f).__module__
+    qualname = getattr(f, "__qualname__", None) or type(f).__qualname__
+    return "|".join([
+        f"cpu={os.cpu_count()}",
+        platform.python_implementation(),
+        sys.version,
+        f"{module}.{qualname}",
+        f"pickle={is_picklable(f)}",
+    ])
+
+
+def load_autotune_cache(path=AUTOTUNE_CACHE):
+    if not path.exists():
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError) as e:
+        print(f"Ошибка при чтении кэша автотюнинга: {e}", file=sys.stderr)
+        return {}
+
+
+def _cached_autotune(path):
+    if path not in _autotune_caches:
+        _autotune_caches[path] = load_autotune_cache(path)
+    return _autotune_caches[path]
+
+
+def save_autotune_cache(cache, path=AUTOTUNE_CACHE):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(cache, file, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _probe(f, a, b, kind, n_jobs, chunk_size, n_iter):
     if n_jobs == 1:
-        return integrate(f, a, b, n_jobs=1, n_iter=n_iter)
+        start_time = time.perf_counter()
+        integrate_parallel(f, a, b, n_jobs=1, n_iter=n_iter, chunk_size=chunk_size)
+        return time.perf_counter() - start_time
     
-    chunk_size = n_iter // n_jobs
-    chunks = []
+    with EXECUTORS[kind](max_workers=n_jobs) as executor:
+        integrate_parallel(f, a, b, n_iter=n_jobs * MIN_CHUNK_SIZE, executor=executor, chunk_size=MIN_CHUNK_SIZE)
+        start_time = time.perf_counter()
+        integrate_parallel(f, a, b, n_iter=n_iter, executor=executor, chunk_size=chunk_size)
+        return time.perf_counter() - start_time
+
+
+def candidate_n_jobs(cpu_count=None):
+    cpu_count = cpu_count or os.cpu_count() or 1
+    candidates = {1, cpu_count, cpu_count * 2}
+    n_jobs = 2
+    while n_jobs < cpu_count * 2:
+        candidates.add(n_jobs)
+        n_jobs *= 2
+    return sorted(candidates)
+
+
+def autotune(f, a=0, b=1, *, n_iter=PROBE_N_ITER, force=False, cache_path=AUTOTUNE_CACHE, verbose=False):
+    key = autotune_key(f)
+    cache = _cached_autotune(cache_path)
+    if key in cache and not force:
+        return cache[key]
+    
+    timings = []
+    default_chunk = default_chunk_size(n_iter)
+    kinds = [kind for kind in EXECUTORS if kind != "process" or is_picklable(f)]
+    for kind in kinds:
+        for n_jobs in candidate_n_jobs():
+            if n_jobs == 1 and timings:
+                continue
+            elapsed_time = _probe(f, a, b, kind, n_jobs, default_chunk, n_iter)
+            timings.append((elapsed_time, kind, n_jobs))
+            if verbose:
+                print(f"{kind:<8} n_jobs={n_jobs:2d}: {elapsed_time:.4f} секунд")
     
-    for i in range(n_jobs):
-        start = i * chunk_size
-        end = (i + 1) * chunk_size if i < n_jobs - 1 else n_iter
-        chunks.append((start, end))
+    _, best_kind, best_n_jobs = min(timings)
     
-    with executor_class(max_workers=n_jobs) as executor:
-        futures = [
-            executor.submit(integrate_chunk, f, a, b, start, end, n_iter)
-            for start, end in chunks
-        ]
-        results = [future.result() for future in futures]
+    best_time, best_chunk = None, None
+    if best_n_jobs > 1:
+        for chunk_size in PROBE_CHUNK_SIZES:
+            elapsed_time = _probe(f, a, b, best_kind, best_n_jobs, chunk_size, n_iter)
+            if verbose:
+                print(f"{best_kind:<8} n_jobs={best_n_jobs:2d} chunk_size={chunk_size}: {elapsed_time:.4f} секунд")
+            if best_time is None or elapsed_time < best_time:
+                best_time, best_chunk = elapsed_time, chunk_size
     
-    return sum(results)
+    config = {
+        "executor": best_kind,
+        "n_jobs": best_n_jobs,
+        "chunk_size": best_chunk,
+    }
+    cache[key] = config
+    save_autotune_cache(cache, cache_path)
+    return config
 
 
-def main():
+def run_sweep():
     cpu_count = os.cpu_count()
     max_jobs = cpu_count * 2
     
@@ -115,6 +285,41 @@ def main():
     print("\nРезультаты сохранены в artifacts/4_2_results.txt")
 
 
+def main():
+    parser = argparse.ArgumentParser(
+        description="Параллельное вычисление integrate с автоматическим выбором executor'а"
+    )
+    parser.add_argument(
+        "--sweep",
+        action="store_true",
+        help="Перебрать все n_jobs для обоих executor'ов и сохранить отчет в artifacts/4_2_results.txt"
+    )
+    parser.add_argument(
+        "--retune",
+        action="store_true",
+        help="Заново выполнить автотюнинг, игнорируя сохраненную конфигурацию"
+    )
+    
+    args = parser.parse_args()
+    
+    if args.sweep:
+        run_sweep()
+        return
+    
+    f = math.cos
+    a = 0
+    b = math.pi / 2
+    n_iter = 10000000
+    
+    config = autotune(f, force=args.retune, verbose=True)
+    print(f"Конфигурация: executor={config['executor']}, n_jobs={config['n_jobs']}, chunk_size={config['chunk_size']}")
+    
+    start_time = time.time()
+    result = integrate_parallel(f, a, b, n_jobs="auto", n_iter=n_iter)
+    elapsed_time = time.time() - start_time
+    print(f"Результат={result:.10f}, время={elapsed_time:.4f} секунд")
+
+
 if __name__ == "__main__":
     main()
 
@@ -1,57 +1,101 @@
-import multiprocessing
+import argparse
+import functools
+import queue
 import sys
 import time
 import threading
 import codecs
 
+from pipeline import Pipeline, Stage
+
+
+PROCESS_A_DELAY = 5
+
 
 def rot13(text):
     return codecs.encode(text, 'rot13')
 
 
-def process_a(input_queue, output_queue):
-    while True:
-        try:
-            message = input_queue.get()
-            if message is None:
-                output_queue.put(None)
-                break
-            
-            lower_message = message.lower()
-            
-            time.sleep(5)
-            output_queue.put(lower_message)
-        except Exception as e:
-            print(f"Ошибка в процессе A: {e}", file=sys.stderr)
-            break
+def process_a(message, delay=PROCESS_A_DELAY):
+    lower_message = message.lower()
+    if delay:
+        time.sleep(delay)
+    return lower_message
 
 
-def process_b(input_queue, output_queue):
-    while True:
-        try:
-            message = input_queue.get()
-            if message is None:
-                output_queue.put(None)
-                break
-            
-            encoded_message = rot13(message)
-            
-            timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-            print(f"[{timestamp}] Процесс B получил: {message} -> {encoded_message}")
-            sys.stdout.flush()
-            
-            output_queue.put(encoded_message)
-        except Exception as e:
-            print(f"Ошибка в процессе B: {e}", file=sys.stderr)
-            break
+def process_b(message, verbose=True):
+    encoded_message = rot13(message)
+    
+    if verbose:
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+        print(f"[{timestamp}] Процесс B получил: {message} -> {encoded_message}")
+        sys.stdout.flush()
+    
+    return encoded_message
+
 
+def build_stages(workers_a=1, workers_b=1, delay=PROCESS_A_DELAY, verbose=True):
+    return [
+        Stage("A", functools.partial(process_a, delay=delay), workers_a),
+        Stage("B", functools.partial(process_b, verbose=verbose), workers_b),
+    ]
 
-def input_reader(input_queue, log_file, log_lock):
-    with log_lock:
-        with open(log_file, "w", encoding="utf-8") as log:
+
+class LogWriter:
+    def __init__(self, log_file, flush_size=100, flush_interval=0.5):
+        self.log_file = log_file
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.records = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+    
+    def __enter__(self):
+        self.thread.start()
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+    
+    def write(self, record):
+        self.records.put(record)
+    
+    def close(self):
+        if self.thread.is_alive():
+            self.records.put(None)
+            self.thread.join()
+    
+    def _run(self):
+        with open(self.log_file, "w", encoding="utf-8") as log:
             log.write("Лог взаимодействия с программой\n")
             log.write("=" * 60 + "\n\n")
-    
+            log.flush()
+            
+            buffer = []
+            last_flush = time.monotonic()
+            running = True
+            while running:
+                timeout = max(0, last_flush + self.flush_interval - time.monotonic()) if buffer else None
+                try:
+                    record = self.records.get(timeout=timeout)
+                    while record is not None:
+                        buffer.append(record)
+                        if len(buffer) >= self.flush_size:
+                            break
+                        record = self.records.get_nowait()
+                    if record is None:
+                        running = False
+                except queue.Empty:
+                    pass
+                
+                if buffer and (not running or len(buffer) >= self.flush_size
+                               or time.monotonic() - last_flush >= self.flush_interval):
+                    log.write("".join(buffer))
+                    log.flush()
+                    buffer.clear()
+                    last_flush = time.monotonic()
+
+
+def input_reader(pipeline, log):
     print("Введите сообщения:")
     
     while True:
@@ -59,104 +103,256 @@ def input_reader(input_queue, log_file, log_lock):
             line = input()
             timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
             
-            with log_lock:
-                with open(log_file, "a", encoding="utf-8") as log:
-                    if line.lower() == 'quit':
-                        log.write(f"[{timestamp}] Пользователь: {line}\n")
-                        log.write(f"[{timestamp}] Завершение работы...\n")
-                        input_queue.put(None)
-                        break
-                    
-                    log.write(f"[{timestamp}] Пользователь отправил: {line}\n")
-            
-            if line.lower() != 'quit':
-                input_queue.put(line)
-            else:
+            if line.lower() == 'quit':
+                log.write(f"[{timestamp}] Пользователь: {line}\n")
+                log.write(f"[{timestamp}] Завершение работы...\n")
+                pipeline.close()
                 break
+            
+            log.write(f"[{timestamp}] Пользователь отправил: {line}\n")
+            pipeline.put(line)
         except EOFError:
             timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-            with log_lock:
-                with open(log_file, "a", encoding="utf-8") as log:
-                    log.write(f"[{timestamp}] EOF получен, завершение...\n")
-            input_queue.put(None)
+            log.write(f"[{timestamp}] EOF получен, завершение...\n")
+            pipeline.close()
             break
         except KeyboardInterrupt:
             timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-            with log_lock:
-                with open(log_file, "a", encoding="utf-8") as log:
-                    log.write(f"[{timestamp}] Прервано пользователем\n")
-            input_queue.put(None)
+            log.write(f"[{timestamp}] Прервано пользователем\n")
+            pipeline.close()
             break
 
 
-def result_collector(result_queue, log_file, log_lock):
-    while True:
-        try:
-            result = result_queue.get()
-            if result is None:
-                break
+def result_collector(pipeline, log):
+    try:
+        for result, error in pipeline.results():
+            if error is not None:
+                print(f"Сообщение не обработано: {error}", file=sys.stderr)
+                continue
             
             timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-            with log_lock:
-                with open(log_file, "a", encoding="utf-8") as log:
-                    log.write(f"[{timestamp}] Главный процесс получил от процесса B: {result}\n")
+            log.write(f"[{timestamp}] Главный процесс получил от процесса B: {result}\n")
             print(f"[{timestamp}] Результат получен: {result}")
-        except Exception as e:
-            print(f"Ошибка при сборе результатов: {e}", file=sys.stderr)
-            break
+    except Exception as e:
+        print(f"Ошибка при сборе результатов: {e}", file=sys.stderr)
 
 
-def main():
-    queue_a_to_b = multiprocessing.Queue()
-    queue_b_to_main = multiprocessing.Queue()
-    queue_main_to_a = multiprocessing.Queue()
-    
+def run_interactive(workers_a=1, workers_b=1, queue_size=100, ordered=True, delay=PROCESS_A_DELAY, transport="queue",
+                    stats_output=None, stats_interval=None):
     log_file = "artifacts/4_3_interaction.txt"
-    log_lock = threading.Lock()
     
-    process_a_instance = multiprocessing.Process(
-        target=process_a,
-        args=(queue_main_to_a, queue_a_to_b)
+    pipeline = Pipeline(
+        build_stages(workers_a, workers_b, delay=delay),
+        queue_size=queue_size,
+        ordered=ordered,
+        transport=transport,
+        stats_output=stats_output,
+        stats_interval=stats_interval
     )
-    process_b_instance = multiprocessing.Process(
-        target=process_b,
-        args=(queue_a_to_b, queue_b_to_main)
+    pipeline.start()
+    
+    with LogWriter(log_file) as log:
+        input_thread = threading.Thread(
+            target=input_reader,
+            args=(pipeline, log),
+            daemon=True
+        )
+        result_thread = threading.Thread(
+            target=result_collector,
+            args=(pipeline, log),
+            daemon=True
+        )
+        
+        input_thread.start()
+        result_thread.start()
+        
+        try:
+            input_thread.join()
+            result_thread.join()
+        except KeyboardInterrupt:
+            print("\nПрерывание...")
+    
+    pipeline.join(timeout=5)
+    
+    print(f"\nЛог сохранен в {log_file}")
+
+
+def run_scaling_benchmark(workers_list, messages=64, delay=0.05, queue_size=100):
+    results = []
+    for workers_a in workers_list:
+        pipeline = Pipeline(build_stages(workers_a, 1, delay=delay, verbose=False), queue_size=queue_size)
+        pipeline.start()
+        
+        start_time = time.perf_counter()
+        feeder = threading.Thread(target=_feed, args=(pipeline, (f"Message {i}" for i in range(messages))), daemon=True)
+        feeder.start()
+        received = sum(1 for _ in pipeline.results())
+        elapsed_time = time.perf_counter() - start_time
+        
+        feeder.join()
+        pipeline.join()
+        results.append((workers_a, received, elapsed_time, received / elapsed_time))
+    return results
+
+
+def _feed(pipeline, messages):
+    for message in messages:
+        pipeline.put(message)
+    pipeline.close()
+
+
+def read_batches(lines, batch_size):
+    batch = []
+    for line in lines:
+        batch.append(line.rstrip("\n"))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _feed_batches(pipeline, input_file, batch_size):
+    try:
+        for batch in read_batches(input_file, batch_size):
+            pipeline.put_batch(batch)
+    finally:
+        pipeline.close()
+
+
+def run_stream(input_path, output_path, batch_size=1000, workers_a=1, workers_b=1,
+               queue_size=100, ordered=True, delay=0, transport="queue", stats_output=None, stats_interval=None):
+    pipeline = Pipeline(
+        build_stages(workers_a, workers_b, delay=delay, verbose=False),
+        queue_size=queue_size,
+        ordered=ordered,
+        transport=transport,
+        stats_output=stats_output,
+        stats_interval=stats_interval
     )
+    pipeline.start()
     
-    process_a_instance.start()
-    process_b_instance.start()
+    input_file = sys.stdin if input_path == "-" else open(input_path, "r", encoding="utf-8")
+    processed = 0
+    failed = 0
+    start_time = time.perf_counter()
+    try:
+        feeder = threading.Thread(target=_feed_batches, args=(pipeline, input_file, batch_size), daemon=True)
+        feeder.start()
+        
+        with open(output_path, "w", encoding="utf-8") as output:
+            for _, results, errors in pipeline.batches():
+                if errors:
+                    failed += len(errors)
+                    results = [result for i, result in enumerate(results) if i not in errors]
+                output.write("".join(result + "\n" for result in results))
+                processed += len(results)
+        
+        feeder.join()
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+    elapsed_time = time.perf_counter() - start_time
     
-    input_thread = threading.Thread(
-        target=input_reader,
-        args=(queue_main_to_a, log_file, log_lock),
-        daemon=True
+    pipeline.join()
+    return processed, failed, elapsed_time
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Конвейер A -> B: A переводит сообщение в нижний регистр, B кодирует его rot13"
+    )
+    parser.add_argument("--workers-a", type=int, default=1, help="Количество процессов стадии A (по умолчанию: 1)")
+    parser.add_argument("--workers-b", type=int, default=1, help="Количество процессов стадии B (по умолчанию: 1)")
+    parser.add_argument("--queue-size", type=int, default=100, help="Максимальный размер очереди между стадиями (по умолчанию: 100)")
+    parser.add_argument(
+        "--transport",
+        choices=["queue", "shm"],
+        default="queue",
+        help="Транспорт между стадиями: multiprocessing.Queue или кольцевой буфер в разделяемой памяти (только один процесс на стадию)"
+    )
+    parser.add_argument(
+        "--stats",
+        type=str,
+        default=None,
+        help="Файл для периодической статистики задержек и глубины очередей по стадиям ('-' - stderr)"
+    )
+    parser.add_argument("--stats-interval", type=float, default=10.0, help="Период вывода статистики в секундах (по умолчанию: 10)")
+    parser.add_argument("--unordered", action="store_true", help="Не сохранять исходный порядок сообщений на выходе")
+    parser.add_argument(
+        "--input",
+        type=str,
+        default=None,
+        help="Файл со входными сообщениями (по одному на строку, '-' - stdin); включает потоковый режим"
     )
-    result_thread = threading.Thread(
-        target=result_collector,
-        args=(queue_b_to_main, log_file, log_lock),
-        daemon=True
+    parser.add_argument("--output", type=str, default="artifacts/4_3_output.txt", help="Файл для результатов потокового режима")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Количество сообщений в одном элементе очереди (по умолчанию: 1000)")
+    parser.add_argument(
+        "--delay",
+        type=float,
+        default=None,
+        help=f"Задержка стадии A на сообщение в секундах (по умолчанию: {PROCESS_A_DELAY} в интерактивном режиме, 0 в потоковом)"
+    )
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Измерить пропускную способность при разном количестве процессов стадии A"
     )
     
-    input_thread.start()
-    result_thread.start()
+    args = parser.parse_args()
     
-    try:
-        input_thread.join()
-        time.sleep(10)
-        result_thread.join(timeout=1)
-    except KeyboardInterrupt:
-        print("\nПрерывание...")
-        queue_main_to_a.put(None)
+    if args.benchmark:
+        workers_list = [1, 2, 4, 8, 16]
+        delay = 0.05
+        results = run_scaling_benchmark(workers_list, delay=delay, queue_size=args.queue_size)
+        
+        with open("artifacts/4_3_scaling.txt", "w", encoding="utf-8") as f:
+            f.write("Масштабирование конвейера по количеству процессов стадии A\n")
+            f.write("=" * 60 + "\n\n")
+            f.write(f"Задержка стадии A: {delay} секунд, процессов стадии B: 1\n\n")
+            f.write(f"{'workers_a':<12} {'Сообщений':<12} {'Время (сек)':<15} {'Сообщений/сек':<15}\n")
+            f.write("-" * 60 + "\n")
+            for workers_a, received, elapsed_time, throughput in results:
+                line = f"{workers_a:<12} {received:<12} {elapsed_time:<15.4f} {throughput:<15.2f}"
+                print(line)
+                f.write(line + "\n")
+        
+        print("\nРезультаты сохранены в artifacts/4_3_scaling.txt")
+        return
     
-    process_a_instance.join(timeout=5)
-    process_b_instance.join(timeout=5)
+    stats_interval = args.stats_interval if args.stats is not None else None
+    stats_output = None if args.stats == "-" else args.stats
     
-    if process_a_instance.is_alive():
-        process_a_instance.terminate()
-    if process_b_instance.is_alive():
-        process_b_instance.terminate()
+    if args.input is not None:
+        processed, failed, elapsed_time = run_stream(
+            args.input,
+            args.output,
+            batch_size=args.batch_size,
+            workers_a=args.workers_a,
+            workers_b=args.workers_b,
+            queue_size=args.queue_size,
+            ordered=not args.unordered,
+            delay=args.delay or 0,
+            transport=args.transport,
+            stats_output=stats_output,
+            stats_interval=stats_interval
+        )
+        print(f"Обработано сообщений: {processed}, с ошибкой: {failed}")
+        print(f"Время выполнения: {elapsed_time:.2f} секунд ({processed / elapsed_time:.0f} сообщений/сек)")
+        print(f"Результаты сохранены в {args.output}")
+        return
     
-    print(f"\nЛог сохранен в {log_file}")
+    delay = PROCESS_A_DELAY if args.delay is None else args.delay
+    run_interactive(
+        args.workers_a,
+        args.workers_b,
+        args.queue_size,
+        not args.unordered,
+        delay,
+        args.transport,
+        stats_output,
+        stats_interval
+    )
 
 
 if __name__ == "__main__":
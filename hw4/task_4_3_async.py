@@ -0,0 +1,207 @@
+import argparse
+import asyncio
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from task_4_3 import rot13, run_scaling_benchmark
+
+
+async def stage_a(message, delay):
+    lower_message = message.lower()
+    await asyncio.sleep(delay)
+    return lower_message
+
+
+async def stage_b(message, executor=None):
+    if executor is None:
+        return rot13(message)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, rot13, message)
+
+
+async def stage_consumer(name, func, input_queue, output_queue):
+    while True:
+        item = await input_queue.get()
+        if item is None:
+            break
+
+        seq, message, error = item
+        if error is None:
+            try:
+                message = await func(message)
+            except Exception as e:
+                error = f"{name}: {e}"
+                print(f"Ошибка в стадии {name}: {e}", file=sys.stderr)
+        await output_queue.put((seq, message, error))
+
+
+async def run_stage(name, func, workers, input_queue, output_queue, next_workers):
+    consumers = [
+        asyncio.create_task(stage_consumer(name, func, input_queue, output_queue))
+        for _ in range(workers)
+    ]
+    await asyncio.gather(*consumers)
+    for _ in range(next_workers):
+        await output_queue.put(None)
+
+
+async def read_lines(input_file):
+    # readline в потоке: ожидание ввода с stdin не останавливает цикл событий
+    loop = asyncio.get_running_loop()
+    while True:
+        line = await loop.run_in_executor(None, input_file.readline)
+        if not line:
+            break
+        yield line.rstrip("\n")
+
+
+async def feed(messages, input_queue, workers):
+    if hasattr(messages, "__aiter__"):
+        seq = 0
+        async for message in messages:
+            await input_queue.put((seq, message, None))
+            seq += 1
+    else:
+        for seq, message in enumerate(messages):
+            await input_queue.put((seq, message, None))
+    for _ in range(workers):
+        await input_queue.put(None)
+
+
+async def run_pipeline(messages, workers_a=1000, workers_b=1, delay=5, queue_size=1000,
+                       ordered=True, executor=None, on_result=None):
+    queue_a = asyncio.Queue(maxsize=queue_size)
+    queue_b = asyncio.Queue(maxsize=queue_size)
+    queue_out = asyncio.Queue(maxsize=queue_size)
+
+    tasks = [
+        asyncio.create_task(feed(messages, queue_a, workers_a)),
+        asyncio.create_task(run_stage("A", lambda m: stage_a(m, delay), workers_a, queue_a, queue_b, workers_b)),
+        asyncio.create_task(run_stage("B", lambda m: stage_b(m, executor), workers_b, queue_b, queue_out, 1)),
+    ]
+
+    received = 0
+    pending = {}
+    expected = 0
+    while True:
+        item = await queue_out.get()
+        if item is None:
+            break
+        if ordered:
+            pending[item[0]] = item
+            while expected in pending:
+                _, result, error = pending.pop(expected)
+                expected += 1
+                received += 1
+                if on_result is not None:
+                    on_result(result, error)
+        else:
+            received += 1
+            if on_result is not None:
+                on_result(item[1], item[2])
+
+    await asyncio.gather(*tasks)
+    return received
+
+
+def max_rss_mb():
+    # ru_maxrss в Linux в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def measure(count, workers_a, delay, offload_b):
+    messages = (f"Message {i}" for i in range(count))
+    if offload_b:
+        with ProcessPoolExecutor() as executor:
+            start_time = time.perf_counter()
+            received = await run_pipeline(messages, workers_a=workers_a, workers_b=4, delay=delay, executor=executor)
+            elapsed_time = time.perf_counter() - start_time
+    else:
+        start_time = time.perf_counter()
+        received = await run_pipeline(messages, workers_a=workers_a, delay=delay)
+        elapsed_time = time.perf_counter() - start_time
+    return received, elapsed_time
+
+
+def run_comparison(count=5000, delay=0.5):
+    lines = []
+    for name, workers_a, offload_b in [
+        ("asyncio", 100, False),
+        ("asyncio", 1000, False),
+        ("asyncio", 5000, False),
+        ("asyncio + процессы B", 5000, True),
+    ]:
+        received, elapsed_time = asyncio.run(measure(count, workers_a, delay, offload_b))
+        lines.append(
+            f"{name:<22} {workers_a:<10} {received:<10} {elapsed_time:<12.2f} "
+            f"{received / elapsed_time:<15.1f} {max_rss_mb():<10.1f}"
+        )
+        print(lines[-1])
+
+    for workers_a, received, elapsed_time, throughput in run_scaling_benchmark([1, 8, 16], messages=32, delay=delay):
+        lines.append(f"{'multiprocessing':<22} {workers_a:<10} {received:<10} {elapsed_time:<12.2f} {throughput:<15.1f} {'-':<10}")
+        print(lines[-1])
+
+    with open("artifacts/4_3_async.txt", "w", encoding="utf-8") as f:
+        f.write("Сравнение asyncio и multiprocessing для стадии A с ожиданием ввода-вывода\n")
+        f.write("=" * 80 + "\n\n")
+        f.write(f"Задержка стадии A: {delay} секунд на сообщение\n")
+        f.write("asyncio: все сообщения в одном процессе, RSS - пиковая память процесса\n")
+        f.write("multiprocessing: один процесс на воркер стадии A\n\n")
+        f.write(f"{'Реализация':<22} {'workers_a':<10} {'Сообщений':<10} {'Время (сек)':<12} {'Сообщений/сек':<15} {'RSS (МБ)':<10}\n")
+        f.write("-" * 80 + "\n")
+        for line in lines:
+            f.write(line + "\n")
+
+    print("\nРезультаты сохранены в artifacts/4_3_async.txt")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Конвейер A -> B на asyncio: N сопрограмм на стадию в одном процессе"
+    )
+    parser.add_argument("--input", type=str, default="-", help="Файл со входными сообщениями ('-' - stdin)")
+    parser.add_argument("--workers-a", type=int, default=1000, help="Количество сопрограмм стадии A (по умолчанию: 1000)")
+    parser.add_argument("--workers-b", type=int, default=1, help="Количество сопрограмм стадии B (по умолчанию: 1)")
+    parser.add_argument("--delay", type=float, default=5, help="Задержка стадии A в секундах (по умолчанию: 5)")
+    parser.add_argument("--offload-b", action="store_true", help="Выполнять стадию B в ProcessPoolExecutor")
+    parser.add_argument("--unordered", action="store_true", help="Не сохранять исходный порядок сообщений на выходе")
+    parser.add_argument("--compare", action="store_true", help="Сравнить с конвейером на процессах")
+    args = parser.parse_args()
+
+    if args.compare:
+        run_comparison()
+        return
+
+    input_file = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8")
+
+    def on_result(result, error):
+        if error is not None:
+            print(f"Сообщение не обработано: {error}", file=sys.stderr)
+        else:
+            print(result)
+
+    async def run():
+        messages = read_lines(input_file)
+        if args.offload_b:
+            with ProcessPoolExecutor() as executor:
+                return await run_pipeline(messages, args.workers_a, args.workers_b, args.delay,
+                                          ordered=not args.unordered, executor=executor, on_result=on_result)
+        return await run_pipeline(messages, args.workers_a, args.workers_b, args.delay,
+                                  ordered=not args.unordered, on_result=on_result)
+
+    try:
+        start_time = time.perf_counter()
+        received = asyncio.run(run())
+        elapsed_time = time.perf_counter() - start_time
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+
+    print(f"Обработано сообщений: {received} за {elapsed_time:.2f} секунд", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
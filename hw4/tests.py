@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+import time
+
+import pytest
+
+from pipeline_stats import PipelineStats
+from shm_ring import RingBuffer, RingQueue
+from task_4_2 import integrate_parallel
+from task_4_3 import rot13, run_stream
+
+
+def test_ring_buffer_wraparound():
+    ring = RingBuffer(capacity=64)
+    try:
+        # записи по 4 + 13 байт: длина и данные переходят через конец буфера
+        for i in range(50):
+            payload = f"message-{i:05d}".encode()
+            ring.put_bytes(payload)
+            assert ring.get_bytes(timeout=1) == payload
+    finally:
+        ring.close()
+
+
+def test_ring_buffer_fills_to_capacity():
+    ring = RingBuffer(capacity=64)
+    try:
+        payloads = [bytes([i]) * 12 for i in range(4)]
+        for _ in range(3):
+            for payload in payloads:
+                ring.put_bytes(payload)
+            assert [ring.get_bytes(timeout=1) for _ in payloads] == payloads
+    finally:
+        ring.close()
+
+
+def test_ring_buffer_rejects_oversized():
+    ring = RingBuffer(capacity=16)
+    try:
+        with pytest.raises(ValueError):
+            ring.put_bytes(b"x" * 13)
+    finally:
+        ring.close()
+
+
+def test_ring_queue_roundtrip():
+    queue = RingQueue(capacity=128)
+    try:
+        for item in [None, 1, "строка", (1, [2, 3]), {"k": 1.5}]:
+            queue.put(item)
+            assert queue.get(timeout=1) == item
+    finally:
+        queue.close()
+
+
+def test_run_stream_output_lines(tmp_path):
+    input_path = tmp_path / "in.txt"
+    output_path = tmp_path / "out.txt"
+    input_path.write_text("".join(f"Message {i}\n" for i in range(25)), encoding="utf-8")
+    
+    processed, failed, _ = run_stream(str(input_path), str(output_path), batch_size=10)
+    
+    assert (processed, failed) == (25, 0)
+    assert output_path.read_text(encoding="utf-8") == "".join(rot13(f"message {i}") + "\n" for i in range(25))
+
+
+def test_pipeline_stats_per_message_service_time():
+    stats = PipelineStats(["A"], [])
+    now = time.monotonic()
+    # пачка из 100 сообщений: ждала в очереди 0.5 с, обрабатывалась 1 с
+    stats.record((now - 1.5, now - 1.0, now), count=100)
+    
+    assert stats.messages == 100
+    assert abs(stats.service["A"].percentile(50) - 0.01) < 0.001
+    assert abs(stats.wait["A"].percentile(50) - 0.5) < 0.05
+
+
+def test_integrate_parallel_rejects_non_positive_chunk_size():
+    for chunk_size in (0, -5):
+        with pytest.raises(ValueError):
+            integrate_parallel(abs, 0, 1, n_iter=100, chunk_size=chunk_size)
+    assert abs(integrate_parallel(abs, 0, 1, n_iter=100, chunk_size=7) - 0.495) < 1e-9
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Замер пропускной способности task_5_1 на локальном mock_image_server.py
+Перебирает способы записи, уровни параллелизма и лимиты коннектора, считает
+изображения/сек, МБ/сек, p99 задержки ответа и загрузку CPU клиента
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+from typing import Dict, List
+
+import aiohttp
+
+from task_5_1 import download_images
+
+
+def make_trace_config(latencies: List[float]) -> aiohttp.TraceConfig:
+    async def on_request_start(session, ctx, params):
+        ctx.start = asyncio.get_running_loop().time()
+
+    async def on_request_end(session, ctx, params):
+        latencies.append(asyncio.get_running_loop().time() - ctx.start)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    return trace_config
+
+
+def run_once(count: int, base_url: str, concurrency: int, connector_limit: int, write_mode: str) -> Dict[str, float]:
+    latencies: List[float] = []
+    trace_config = make_trace_config(latencies)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start_time = time.perf_counter()
+        start_cpu = time.process_time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats = asyncio.run(download_images(
+                count,
+                Path(tmp_dir),
+                max_concurrent=concurrency,
+                initial_concurrent=concurrency,
+                base_url=base_url,
+                connector_limit=connector_limit,
+                trace_configs=[trace_config],
+                write_mode=write_mode
+            ))
+        cpu_time = time.process_time() - start_cpu
+        elapsed_time = time.perf_counter() - start_time
+        downloaded = sum(path.stat().st_size for path in (Path(tmp_dir) / ".store" / "objects").iterdir())
+
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] if latencies else 0.0
+    return {
+        'successful': stats.successful,
+        'images_per_sec': stats.successful / elapsed_time,
+        'mb_per_sec': downloaded / elapsed_time / 2 ** 20,
+        'p99_ms': p99 * 1000,
+        'cpu_percent': cpu_time / elapsed_time * 100,
+        'cpu_ms_per_mb': cpu_time * 1000 / (downloaded / 2 ** 20) if downloaded else 0.0,
+    }
+
+
+def wait_for_server(base_url: str, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"{base_url}/stats", timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Сервер {base_url} не запустился")
+
+
+def parse_int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(',') if item]
+
+
+def parse_str_list(value: str) -> List[str]:
+    return [item for item in value.split(',') if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Замер скорости task_5_1 на локальном сервере изображений"
+    )
+    parser.add_argument("-n", "--count", type=int, default=1000, help="Количество изображений на один замер (по умолчанию: 1000)")
+    parser.add_argument("--concurrency", type=parse_int_list, default=[1, 4, 16, 64], help="Уровни параллелизма через запятую")
+    parser.add_argument("--connector-limits", type=parse_int_list, default=[0, 16], help="Лимиты TCPConnector через запятую (0 - без лимита)")
+    parser.add_argument("--write-modes", type=parse_str_list, default=["aiofiles", "buffered"], help="Способы записи через запятую")
+    parser.add_argument("--port", type=int, default=8090, help="Порт mock_image_server.py (по умолчанию: 8090)")
+    parser.add_argument("--base-url", type=str, default=None, help="Использовать уже запущенный сервер вместо локального")
+    parser.add_argument("--latency", type=float, default=0.05, help="Задержка сервера в секундах (по умолчанию: 0.05)")
+    parser.add_argument("--bandwidth", type=float, default=None, help="Скорость отдачи сервера в байтах/сек на ответ")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов 5xx (по умолчанию: 0)")
+    parser.add_argument("--max-concurrent", type=int, default=None, help="Сервер отвечает 429 при большем числе одновременных запросов")
+    parser.add_argument("--output", type=str, default="artifacts/5_1_benchmark.txt", help="Файл с результатами")
+
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        base_url = f"http://127.0.0.1:{args.port}"
+        command = [
+            sys.executable, str(Path(__file__).with_name("mock_image_server.py")),
+            "--port", str(args.port),
+            "--latency", str(args.latency),
+            "--error-rate", str(args.error_rate),
+        ]
+        if args.bandwidth:
+            command += ["--bandwidth", str(args.bandwidth)]
+        if args.max_concurrent:
+            command += ["--max-concurrent", str(args.max_concurrent)]
+        server = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+
+    header = (
+        f"{'write_mode':<10} {'concurrency':<12} {'connector':<10} {'Изобр./сек':<12} {'МБ/сек':<10} "
+        f"{'p99 (мс)':<10} {'CPU (%)':<8} {'CPU мс/МБ':<10}"
+    )
+    lines = []
+    try:
+        wait_for_server(base_url)
+        print(header)
+        for write_mode in args.write_modes:
+            for connector_limit in args.connector_limits:
+                for concurrency in args.concurrency:
+                    result = run_once(args.count, base_url, concurrency, connector_limit, write_mode)
+                    line = (
+                        f"{write_mode:<10} {concurrency:<12} {connector_limit or 'нет':<10} {result['images_per_sec']:<12.1f} "
+                        f"{result['mb_per_sec']:<10.2f} {result['p99_ms']:<10.1f} {result['cpu_percent']:<8.1f} "
+                        f"{result['cpu_ms_per_mb']:<10.1f}"
+                    )
+                    print(line)
+                    lines.append(line)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        f.write("Замер скорости скачивания изображений (task_5_1.py)\n")
+        f.write("=" * 90 + "\n\n")
+        f.write(f"Сервер: {base_url}, изображений на замер: {args.count}, задержка сервера: {args.latency} сек\n\n")
+        f.write(header + "\n")
+        f.write("-" * 90 + "\n")
+        for line in lines:
+            f.write(line + "\n")
+
+    print(f"\nРезультаты сохранены в {output}")
+
+
+if __name__ == "__main__":
+    main()
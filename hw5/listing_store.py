@@ -0,0 +1,175 @@
+"""
+Хранилище объявлений для task_5_2.py: сегменты JSON Lines, дописываемые в конец
+"""
+
+import gzip
+import json
+import os
+import re
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+SEGMENT_RE = re.compile(r'^segment_(\d+)\.jsonl(\.gz)?$')
+MAX_SEGMENT_BYTES = 8 * 2 ** 20
+
+
+def _fsync_dir(path: Path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _complete_gzip_length(data: bytes) -> int:
+    """Длина префикса из целых gzip-членов"""
+    view = memoryview(data)
+    offset = 0
+    while offset < len(data):
+        decompressor = zlib.decompressobj(wbits=31)
+        try:
+            decompressor.decompress(view[offset:])
+        except zlib.error:
+            break
+        if not decompressor.eof:
+            break
+        offset = len(data) - len(decompressor.unused_data)
+    return offset
+
+
+class ListingStore:
+    """Объявления в файлах segment_NNNNNN.jsonl[.gz], по одной записи на строку.
+
+    Запись всегда идет в последний сегмент; пачка пишется одним вызовом и
+    завершается fsync. В сжатом режиме каждая пачка - отдельный gzip-член,
+    которые gzip читает подряд как один поток. Сегмент больше max_segment_bytes
+    закрывается, следующая пачка начинает новый. compact() сливает закрытые
+    сегменты в один, оставляя первую запись для каждого id. Оборванная при
+    сбое пачка в конце последнего сегмента отрезается при открытии, иначе
+    следующая пачка склеилась бы с ней и все записи после обрыва потерялись бы.
+    """
+
+    def __init__(self, root: Path, compress: bool = False, max_segment_bytes: int = MAX_SEGMENT_BYTES):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.compress = compress
+        self.max_segment_bytes = max_segment_bytes
+        self.root.joinpath('compact.tmp').unlink(missing_ok=True)
+        self._repair_tail()
+
+    def segments(self) -> List[Tuple[int, Path]]:
+        segments = []
+        for path in self.root.iterdir():
+            match = SEGMENT_RE.match(path.name)
+            if match:
+                segments.append((int(match.group(1)), path))
+        segments.sort()
+        return segments
+
+    def _repair_tail(self):
+        segments = self.segments()
+        if not segments:
+            return
+        path = segments[-1][1]
+        with open(path, 'rb+') as f:
+            data = f.read()
+            end = _complete_gzip_length(data) if path.name.endswith('.gz') else data.rfind(b'\n') + 1
+            if end != len(data):
+                f.truncate(end)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _segment_path(self, number: int) -> Path:
+        return self.root / f"segment_{number:06d}.jsonl{'.gz' if self.compress else ''}"
+
+    def _active_segment(self) -> Path:
+        segments = self.segments()
+        if not segments:
+            return self._segment_path(1)
+        number, path = segments[-1]
+        if path.stat().st_size >= self.max_segment_bytes or path.name.endswith('.gz') != self.compress:
+            return self._segment_path(number + 1)
+        return path
+
+    def append(self, listings: Iterable[Dict]) -> Optional[Path]:
+        data = ''.join(json.dumps(listing, ensure_ascii=False, separators=(',', ':')) + '\n' for listing in listings)
+        if not data:
+            return None
+        path = self._active_segment()
+        payload = data.encode('utf-8')
+        if self.compress:
+            payload = gzip.compress(payload, compresslevel=6)
+        created = not path.exists()
+        with open(path, 'ab') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        if created:
+            _fsync_dir(self.root)
+        return path
+
+    @staticmethod
+    def read_segment(path: Path) -> Iterator[Dict]:
+        """Записи сегмента по одной; оборванная последняя запись пропускается"""
+        opener = gzip.open if path.name.endswith('.gz') else open
+        try:
+            with opener(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    if not line.endswith('\n'):
+                        break
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+        except (EOFError, gzip.BadGzipFile):
+            return
+
+    def iter_records(self, unique: bool = False) -> Iterator[Dict]:
+        seen = set()
+        for _, path in self.segments():
+            for listing in self.read_segment(path):
+                if unique:
+                    listing_id = listing.get('id')
+                    if listing_id in seen:
+                        continue
+                    seen.add(listing_id)
+                yield listing
+
+    def compact(self) -> Tuple[int, int]:
+        """Слить все сегменты, кроме последнего, в один без повторов id.
+
+        Результат атомарно заменяет самый новый из сливаемых сегментов, и
+        только потом удаляются остальные: при обрыве на любом шаге записи
+        могут задвоиться, но не потеряться. Возвращает (записей до, после).
+        """
+        segments = self.segments()[:-1]
+        if len(segments) < 2:
+            return 0, 0
+
+        target = segments[-1][1]
+        tmp_path = self.root / 'compact.tmp'
+        seen = set()
+        before = after = 0
+        opener = gzip.open if target.name.endswith('.gz') else open
+        with opener(tmp_path, 'wt', encoding='utf-8') as out:
+            for _, path in segments:
+                for listing in self.read_segment(path):
+                    before += 1
+                    listing_id = listing.get('id')
+                    if listing_id in seen:
+                        continue
+                    seen.add(listing_id)
+                    out.write(json.dumps(listing, ensure_ascii=False, separators=(',', ':')) + '\n')
+                    after += 1
+        with open(tmp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, target)
+        _fsync_dir(self.root)
+        for _, path in segments[:-1]:
+            path.unlink()
+        return before, after
+
+    def disk_usage(self) -> int:
+        return sum(path.stat().st_size for _, path in self.segments())
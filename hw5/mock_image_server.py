@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Локальный сервер с API как у picsum.photos (/id/{id}/{width}/{height})
+Отдает синтетические изображения с настраиваемой задержкой, ограничением
+скорости, долей ошибок и ответами 429
+"""
+
+import argparse
+import asyncio
+import io
+import random
+import struct
+import zlib
+from aiohttp import web
+from typing import Dict, Optional
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+def synthetic_image(image_id: int, width: int, height: int, size: int) -> bytes:
+    """JPEG через Pillow, если он установлен, иначе псевдослучайные байты с маркерами JPEG"""
+    if Image is not None:
+        rng = random.Random(image_id)
+        image = Image.new('RGB', (width, height), (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+        image.putpixel((image_id % width, image_id % height), (255, 255, 255))
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=90)
+        return buffer.getvalue()
+
+    rng = random.Random(image_id)
+    body = rng.randbytes(max(size - 6, 0))
+    return b'\xff\xd8' + struct.pack('>I', zlib.crc32(body)) + body + b'\xff\xd9'
+
+
+class MockImageServer:
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, bandwidth: Optional[float] = None,
+                 error_rate: float = 0.0, rate_429: float = 0.0, max_concurrent: Optional[int] = None,
+                 retry_after: float = 1.0, image_size: int = 50000):
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.rate_429 = rate_429
+        self.max_concurrent = max_concurrent
+        self.retry_after = retry_after
+        self.image_size = image_size
+        self.active = 0
+        self.stats = {'requests': 0, 'ok': 0, 'errors': 0, 'throttled': 0}
+        self._images: Dict[tuple, bytes] = {}
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/id/{image_id}/{width}/{height}', self.handle_image)
+        app.router.add_get('/stats', self.handle_stats)
+        return app
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({**self.stats, 'active': self.active})
+
+    async def handle_image(self, request: web.Request) -> web.StreamResponse:
+        self.stats['requests'] += 1
+
+        if (self.max_concurrent is not None and self.active >= self.max_concurrent) or random.random() < self.rate_429:
+            self.stats['throttled'] += 1
+            return web.Response(status=429, headers={'Retry-After': f"{self.retry_after:g}"})
+
+        self.active += 1
+        try:
+            delay = self.latency + random.uniform(-self.jitter, self.jitter)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            if random.random() < self.error_rate:
+                self.stats['errors'] += 1
+                return web.Response(status=random.choice([500, 502, 503]))
+
+            key = (int(request.match_info['image_id']), int(request.match_info['width']), int(request.match_info['height']))
+            if key not in self._images:
+                self._images[key] = synthetic_image(*key, self.image_size)
+            body = self._images[key]
+
+            response = web.StreamResponse(headers={'Content-Type': 'image/jpeg'})
+            response.content_length = len(body)
+            await response.prepare(request)
+
+            chunk_size = 16384
+            for offset in range(0, len(body), chunk_size):
+                chunk = body[offset:offset + chunk_size]
+                await response.write(chunk)
+                if self.bandwidth:
+                    await asyncio.sleep(len(chunk) / self.bandwidth)
+            await response.write_eof()
+
+            self.stats['ok'] += 1
+            return response
+        finally:
+            self.active -= 1
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Локальный сервер синтетических изображений для тестирования task_5_1.py"
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Адрес (по умолчанию: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8080, help="Порт (по умолчанию: 8080)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Задержка перед ответом в секундах (по умолчанию: 0)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Случайное отклонение задержки в секундах (по умолчанию: 0)")
+    parser.add_argument("--bandwidth", type=float, default=None, help="Скорость отдачи одного ответа в байтах/сек (по умолчанию: без ограничений)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов 5xx (по умолчанию: 0)")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Доля случайных ответов 429 (по умолчанию: 0)")
+    parser.add_argument("--max-concurrent", type=int, default=None, help="Отвечать 429 при большем числе одновременных запросов")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Значение заголовка Retry-After для ответов 429 (по умолчанию: 1)")
+    parser.add_argument("--image-size", type=int, default=50000, help="Размер изображения без Pillow в байтах (по умолчанию: 50000)")
+
+    args = parser.parse_args()
+
+    server = MockImageServer(
+        latency=args.latency,
+        jitter=args.jitter,
+        bandwidth=args.bandwidth,
+        error_rate=args.error_rate,
+        rate_429=args.rate_429,
+        max_concurrent=args.max_concurrent,
+        retry_after=args.retry_after,
+        image_size=args.image_size
+    )
+    print(f"Сервер изображений запущен на http://{args.host}:{args.port}")
+    web.run_app(server.make_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Адаптивное расписание проверок для task_5_2.py и task_5_3.py
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import math
+import os
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Hashable, List, Optional, Tuple
+
+
+@dataclass
+class ArrivalRate:
+    """Оценка частоты появления новых объявлений (объявлений в секунду).
+
+    rate - экспоненциальное скользящее среднее по всем проверкам, hourly - такое
+    же среднее отдельно для каждого часа суток. Оценка берет большее из них,
+    поэтому всплеск виден сразу, а пиковый час по истории прошлых дней -
+    заранее, еще до первой проверки в нем.
+    """
+    rate: Optional[float] = None
+    hourly: Dict[int, float] = field(default_factory=dict)
+    last_poll: Optional[float] = None
+
+    @staticmethod
+    def _blend(old: Optional[float], observed: float, weight: float) -> float:
+        return observed if old is None else old + weight * (observed - old)
+
+    def update(self, new_count: int, now: float, half_life: float):
+        if self.last_poll is None:
+            self.last_poll = now
+            return
+        elapsed = max(now - self.last_poll, 1e-3)
+        self.last_poll = now
+        observed = new_count / elapsed
+        # вес наблюдения зависит от покрытого им времени: проверки идут нерегулярно
+        weight = 1 - math.exp(-elapsed * math.log(2) / half_life)
+        self.rate = self._blend(self.rate, observed, weight)
+        hour = datetime.fromtimestamp(now).hour
+        self.hourly[hour] = self._blend(self.hourly.get(hour), observed, weight)
+
+    def estimate(self, now: float, horizon: float = 0.0) -> Optional[float]:
+        """Наибольшая ожидаемая частота на отрезке [now, now + horizon]"""
+        estimates = [self.rate] if self.rate is not None else []
+        for hour_start in range(int(now // 3600), int((now + horizon) // 3600) + 1):
+            hourly = self.hourly.get(datetime.fromtimestamp(max(hour_start * 3600, now)).hour)
+            if hourly is not None:
+                estimates.append(hourly)
+        return max(estimates) if estimates else None
+
+
+class AdaptiveScheduler:
+    """Очередь с приоритетом по времени следующей проверки каждого запроса.
+
+    После проверки интервал выбирается так, чтобы к следующей накопилось около
+    target_new новых объявлений, и ограничивается [min_interval, max_interval].
+    К интервалу добавляется случайное отклонение до jitter, чтобы запросы не
+    собирались в одну пачку. Оценки частот сохраняются в state_path.
+    """
+
+    def __init__(self, min_interval: float = 120, max_interval: float = 3600, target_new: float = 1.0,
+                 half_life: float = 1800, jitter: float = 0.1, state_path: Optional[Path] = None,
+                 coalesce: float = 0.05):
+        self.min_interval = min(min_interval, max_interval)
+        self.max_interval = max_interval
+        self.target_new = target_new
+        self.half_life = half_life
+        self.jitter = jitter
+        self.state_path = state_path
+        # запросы со сроком в пределах coalesce * min_interval проверяются вместе
+        self.coalesce = coalesce * self.min_interval
+        self.heap: List[Tuple[float, int, Hashable]] = []
+        self.due: Dict[Hashable, float] = {}
+        self.rates: Dict[str, ArrivalRate] = {}
+        self._counter = itertools.count()
+        self._changed = asyncio.Event()
+        self._load()
+
+    @staticmethod
+    def _key(query: Hashable) -> str:
+        return repr(query)
+
+    def _load(self):
+        if self.state_path is None or not self.state_path.exists():
+            return
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                for key, value in json.load(f).items():
+                    self.rates[key] = ArrivalRate(value['rate'], {int(hour): rate for hour, rate in value['hourly'].items()})
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ошибка при загрузке {self.state_path}: {e}")
+
+    def save(self):
+        if self.state_path is None:
+            return
+        tmp_path = self.state_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({key: {'rate': rate.rate, 'hourly': rate.hourly} for key, rate in self.rates.items()}, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _push(self, query: Hashable, due: float):
+        self.due[query] = due
+        heapq.heappush(self.heap, (due, next(self._counter), query))
+        self._changed.set()
+
+    def add(self, query: Hashable, delay: Optional[float] = None):
+        """Добавить запрос; первая проверка - через delay или в случайный момент первых jitter * min_interval"""
+        if query in self.due:
+            return
+        if delay is None:
+            delay = random.uniform(0, self.jitter * self.min_interval)
+        self.rates.setdefault(self._key(query), ArrivalRate())
+        self._push(query, time.time() + delay)
+
+    def remove(self, query: Hashable):
+        # запись в куче остается и пропускается при извлечении
+        self.due.pop(query, None)
+        self._changed.set()
+
+    def queries(self) -> List[Hashable]:
+        return list(self.due)
+
+    def next_interval(self, query: Hashable, now: Optional[float] = None) -> float:
+        now = time.time() if now is None else now
+        rate = self.rates[self._key(query)].estimate(now, self.max_interval)
+        if not rate:
+            interval = self.max_interval
+        else:
+            interval = min(max(self.target_new / rate, self.min_interval), self.max_interval)
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def record(self, query: Hashable, new_count: int, now: Optional[float] = None) -> float:
+        """Учесть результат проверки и поставить запрос в очередь; возвращает интервал"""
+        now = time.time() if now is None else now
+        self.rates.setdefault(self._key(query), ArrivalRate()).update(new_count, now, self.half_life)
+        interval = self.next_interval(query, now)
+        if query in self.due:
+            self._push(query, now + interval)
+        return interval
+
+    def _pop_stale(self):
+        while self.heap and self.due.get(self.heap[0][2]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+
+    async def next_batch(self) -> List[Hashable]:
+        """Дождаться ближайшей проверки и вернуть все запросы, срок которых подошел.
+
+        Каждый возвращенный запрос снова попадает в очередь только через record().
+        """
+        while True:
+            self._changed.clear()
+            self._pop_stale()
+            timeout = self.heap[0][0] - time.time() if self.heap else None
+            if timeout is not None and timeout <= 0:
+                break
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        batch = []
+        horizon = time.time() + self.coalesce
+        while self.heap and self.heap[0][0] <= horizon:
+            due, _, query = heapq.heappop(self.heap)
+            if self.due.get(query) == due:
+                batch.append(query)
+        return batch
@@ -0,0 +1,102 @@
+"""
+Постоянный индекс уже виденных ID объявлений для task_5_2.py
+"""
+
+import hashlib
+import math
+import os
+from pathlib import Path
+from typing import Iterable, Optional
+
+
+RECORD_SIZE = 16
+READ_CHUNK = RECORD_SIZE * 65536
+
+
+def id_digest(listing_id: str) -> bytes:
+    """16 байт ID: ID объявлений - это md5 в hex, остальные строки хэшируются"""
+    if len(listing_id) == 32:
+        try:
+            return bytes.fromhex(listing_id)
+        except ValueError:
+            pass
+    return hashlib.md5(listing_id.encode('utf-8')).digest()
+
+
+class BloomFilter:
+    """Фильтр Блума над 16-байтными дайджестами.
+
+    Дайджесты уже равномерно распределены, поэтому k позиций получаются
+    двойным хэшированием из двух половин дайджеста без дополнительных хэшей.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 1e-6):
+        self.n_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.n_hashes = max(1, round(self.n_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.n_bits + 7) // 8)
+
+    def _positions(self, digest: bytes):
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.n_hashes):
+            yield (h1 + i * h2) % self.n_bits
+
+    def add(self, digest: bytes):
+        for position in self._positions(digest):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, digest: bytes) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(digest))
+
+
+class SeenIndex:
+    """Файл из записей по 16 байт, дописываемый в конец, и его копия в памяти.
+
+    Файл читается один раз при создании; новые ID дописываются одной
+    записью на пачку. Неполная запись в конце (обрыв при записи) отбрасывается.
+    С bloom_capacity в памяти хранится фильтр Блума вместо множества: память
+    не зависит от длины истории, но с вероятностью error_rate новое
+    объявление будет принято за уже виденное.
+    """
+
+    def __init__(self, path: Path, bloom_capacity: Optional[int] = None, error_rate: float = 1e-6):
+        self.path = path
+        self.count = 0
+        self.digests = BloomFilter(bloom_capacity, error_rate) if bloom_capacity else set()
+        self.existed = path.exists()
+        if self.existed:
+            self._load()
+
+    def _load(self):
+        with open(self.path, 'rb+') as f:
+            while True:
+                chunk = f.read(READ_CHUNK)
+                for offset in range(0, len(chunk) - RECORD_SIZE + 1, RECORD_SIZE):
+                    self.digests.add(chunk[offset:offset + RECORD_SIZE])
+                    self.count += 1
+                if len(chunk) < READ_CHUNK:
+                    break
+            if f.tell() != self.count * RECORD_SIZE:
+                f.truncate(self.count * RECORD_SIZE)
+
+    def __contains__(self, listing_id: str) -> bool:
+        return id_digest(listing_id) in self.digests
+
+    def __len__(self) -> int:
+        return self.count
+
+    def add_many(self, listing_ids: Iterable[str]) -> int:
+        records = []
+        for listing_id in listing_ids:
+            digest = id_digest(listing_id)
+            if digest not in self.digests:
+                self.digests.add(digest)
+                records.append(digest)
+        if records:
+            with open(self.path, 'ab') as f:
+                f.write(b''.join(records))
+                f.flush()
+                os.fsync(f.fileno())
+            self.count += len(records)
+        self.existed = True
+        return len(records)
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 """
-Асинхронное скачивание картинок с picsum.photos
+Асинхронное скачивание картинок с picsum.photos (или другого сервера с тем же API, см. --base-url)
 Использует aiohttp для неблокирующих HTTP запросов
 """
 
@@ -8,50 +8,549 @@ import asyncio
 import aiohttp
 import aiofiles
 import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
 from pathlib import Path
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
 import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 
-async def download_image(session: aiohttp.ClientSession, image_id: int, output_dir: Path, semaphore: asyncio.Semaphore) -> bool:
-    url = f"https://picsum.photos/id/{image_id % 1000}/800/600"
-    filename = output_dir / f"image_{image_id}.jpg"
+DEFAULT_BASE_URL = "https://picsum.photos"
+
+
+def _write_all(fd: int, data: bytearray) -> None:
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+def _close_when_done(write: asyncio.Future, fd: int) -> None:
+    """Закрыть fd после завершения записи в потоке пула; ее ошибка уже не важна"""
+    def close(future: asyncio.Future) -> None:
+        if not future.cancelled():
+            future.exception()
+        os.close(fd)
+    
+    write.add_done_callback(close)
+
+
+class BufferedFileWriter:
+    """Запись ответов крупными блоками через отдельный ограниченный пул потоков.
+    
+    Вместо передачи в пул каждого 8 КБ куска данные копятся в буфере
+    buffer_size байт; пока пишется один блок, накапливается следующий.
+    При известном Content-Length место под файл выделяется заранее (кроме
+    сжатых ответов: Content-Length у них - размер до распаковки).
+    """
+    
+    def __init__(self, workers: int = 4, buffer_size: int = 256 * 1024):
+        self.buffer_size = buffer_size
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-writer")
+    
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+    
+    async def write_response(self, response: aiohttp.ClientResponse, path: Path, hasher) -> int:
+        loop = asyncio.get_running_loop()
+        expected = None if response.headers.get('Content-Encoding') else response.content_length
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        pending = None
+        try:
+            if expected and hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(fd, 0, expected)
+                except OSError:
+                    pass
+            
+            size = 0
+            buffer = bytearray()
+            async for chunk in response.content.iter_chunked(65536):
+                hasher.update(chunk)
+                size += len(chunk)
+                buffer += chunk
+                if len(buffer) >= self.buffer_size:
+                    if pending is not None:
+                        await asyncio.shield(pending)
+                    data, buffer = buffer, bytearray()
+                    pending = loop.run_in_executor(self.executor, _write_all, fd, data)
+            
+            if buffer:
+                if pending is not None:
+                    await asyncio.shield(pending)
+                pending = loop.run_in_executor(self.executor, _write_all, fd, buffer)
+            if pending is not None:
+                await asyncio.shield(pending)
+        finally:
+            # при ошибке или отмене запись может еще идти в потоке пула:
+            # закрытый раньше времени номер fd успел бы получить другой файл
+            if pending is not None and not pending.done():
+                _close_when_done(pending, fd)
+            else:
+                os.close(fd)
+        
+        if expected is not None and size != expected:
+            raise IOError(f"получено {size} байт из {expected}")
+        return size
+
+
+class ImageStore:
+    """Хранилище скачанных файлов с адресацией по содержимому.
+
+    Каждый уникальный URL скачивается один раз в objects/<sha256>, файлы
+    изображений - жесткие ссылки на объект. Манифест (JSON Lines, только
+    дописывание) хранит соответствия url -> хэш с размером и при загрузке
+    переписывается без повторов. Файлы в памяти не учитываются: готовым
+    считается файл, который указывает на тот же inode, что и объект его URL,
+    поэтому память не растет с числом изображений.
+    """
+    
+    def __init__(self, root: Path, writer: Optional[BufferedFileWriter] = None):
+        self.root = root
+        self.writer = writer
+        self.objects_dir = root / "objects"
+        self.tmp_dir = root / "tmp"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        for stale in self.tmp_dir.glob("*.part"):
+            stale.unlink(missing_ok=True)
+        self.manifest_file = root / "manifest.jsonl"
+        self.urls: Dict[str, Dict] = {}
+        self.in_flight: Dict[str, asyncio.Future] = {}
+        self._tmp_counter = 0
+        self._load_manifest()
+        self._manifest = open(self.manifest_file, 'a', encoding='utf-8')
+    
+    def _load_manifest(self) -> None:
+        if not self.manifest_file.exists():
+            return
+        
+        lines = 0
+        with open(self.manifest_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                lines += 1
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                # записи о файлах из прежних версий манифеста больше не нужны
+                if 'url' in record and 'file' not in record:
+                    self.urls[record['url']] = record
+        
+        if lines > len(self.urls):
+            tmp_path = self.manifest_file.with_suffix('.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for record in self.urls.values():
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.manifest_file)
+    
+    def _append_manifest(self, record: Dict) -> None:
+        self._manifest.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._manifest.flush()
+    
+    def close(self) -> None:
+        self._manifest.close()
+        if self.writer is not None:
+            self.writer.close()
+    
+    def object_path(self, digest: str) -> Path:
+        return self.objects_dir / digest
+    
+    def tmp_path(self) -> Path:
+        self._tmp_counter += 1
+        return self.tmp_dir / f"{os.getpid()}_{self._tmp_counter}.part"
+    
+    def lookup_url(self, url: str) -> Optional[str]:
+        record = self.urls.get(url)
+        if record is None:
+            return None
+        path = self.object_path(record['sha256'])
+        if not path.exists() or path.stat().st_size != record['size']:
+            return None
+        return record['sha256']
     
-    async with semaphore:
+    def is_complete(self, filename: Path, url: str) -> Optional[str]:
+        """Хэш объекта, если filename - готовая ссылка на объект url, иначе None"""
+        digest = self.lookup_url(url)
+        if digest is None:
+            return None
         try:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    async with aiofiles.open(filename, 'wb') as f:
-                        async for chunk in response.content.iter_chunked(8192):
-                            await f.write(chunk)
-                    return True
-                else:
-                    print(f"Ошибка при загрузке изображения {image_id}: статус {response.status}")
-                    return False
+            file_stat = filename.stat()
+        except FileNotFoundError:
+            return None
+        object_stat = self.object_path(digest).stat()
+        if (file_stat.st_ino, file_stat.st_dev) == (object_stat.st_ino, object_stat.st_dev):
+            return digest
+        # без жестких ссылок файл - копия объекта (см. link_file)
+        return digest if file_stat.st_nlink == 1 and file_stat.st_size == object_stat.st_size else None
+    
+    def commit_object(self, tmp_path: Path, url: str, digest: str, size: int) -> None:
+        path = self.object_path(digest)
+        if path.exists() and path.stat().st_size == size:
+            tmp_path.unlink()
+        else:
+            os.replace(tmp_path, path)
+        record = {'url': url, 'sha256': digest, 'size': size}
+        self.urls[url] = record
+        self._append_manifest(record)
+    
+    def link_file(self, filename: Path, url: str, digest: str) -> None:
+        path = self.object_path(digest)
+        tmp_link = self.tmp_path()
+        try:
+            os.link(path, tmp_link)
+        except OSError:
+            shutil.copyfile(path, tmp_link)
+        os.replace(tmp_link, filename)
+    
+    async def get_object(self, url: str, fetch: Callable[[str], Awaitable[str]]) -> str:
+        digest = self.lookup_url(url)
+        if digest is not None:
+            return digest
+        
+        if url in self.in_flight:
+            return await asyncio.shield(self.in_flight[url])
+        
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[url] = future
+        try:
+            digest = await fetch(url)
+            future.set_result(digest)
+            return digest
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            del self.in_flight[url]
+
+
+class HTTPStatusError(Exception):
+    def __init__(self, status: int, retry_after: Optional[float] = None):
+        super().__init__(f"статус {status}")
+        self.status = status
+        self.retry_after = retry_after
+    
+    @property
+    def retryable(self) -> bool:
+        return self.status == 429 or self.status >= 500
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class AdaptiveLimiter:
+    """Ограничение одновременных запросов к хосту по схеме AIMD.
+    
+    Пока задержка ответа не превышает базовую больше чем в latency_tolerance
+    раз, лимит растет примерно на 1 за каждые limit успешных запросов; при
+    429/5xx или таймауте лимит уменьшается в decrease_factor раз, но не чаще
+    одного раза за время ответа.
+    """
+    
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = 64,
+                 decrease_factor: float = 0.5, latency_tolerance: float = 2.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.in_use = 0
+        self.baseline_latency: Optional[float] = None
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+    
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_use < int(self.limit))
+            self.in_use += 1
+        return self
+    
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        async with self._condition:
+            self.in_use -= 1
+            self._condition.notify_all()
+    
+    def on_success(self, latency: float) -> None:
+        if self.baseline_latency is None:
+            self.baseline_latency = latency
+        else:
+            self.baseline_latency += 0.05 * (latency - self.baseline_latency)
+        
+        if latency <= self.baseline_latency * self.latency_tolerance:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+    
+    def on_congestion(self) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < (self.baseline_latency or 1.0):
+            return
+        self._last_decrease = now
+        self.limit = max(self.minimum, self.limit * self.decrease_factor)
+
+
+class HostLimiters:
+    def __init__(self, initial: int, maximum: int):
+        self.initial = initial
+        self.maximum = maximum
+        self.limiters: Dict[str, AdaptiveLimiter] = {}
+    
+    def get(self, url: str) -> AdaptiveLimiter:
+        host = urlsplit(url).netloc
+        if host not in self.limiters:
+            self.limiters[host] = AdaptiveLimiter(initial=min(self.initial, self.maximum), maximum=self.maximum)
+        return self.limiters[host]
+
+
+async def fetch_to_store(session: aiohttp.ClientSession, url: str, store: ImageStore) -> str:
+    tmp_path = store.tmp_path()
+    hasher = hashlib.sha256()
+    size = 0
+    
+    try:
+        async with session.get(url) as response:
+            if response.status != 200:
+                raise HTTPStatusError(response.status, parse_retry_after(response.headers.get('Retry-After')))
+            if store.writer is not None:
+                size = await store.writer.write_response(response, tmp_path, hasher)
+            else:
+                async with aiofiles.open(tmp_path, 'wb') as f:
+                    async for chunk in response.content.iter_chunked(8192):
+                        hasher.update(chunk)
+                        size += len(chunk)
+                        await f.write(chunk)
+        
+        digest = hasher.hexdigest()
+        store.commit_object(tmp_path, url, digest, size)
+        return digest
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+async def fetch_with_retry(session: aiohttp.ClientSession, url: str, store: ImageStore, limiters: HostLimiters,
+                           retries: int = 5, base_delay: float = 0.5, max_delay: float = 30.0) -> str:
+    limiter = limiters.get(url)
+    for attempt in range(retries + 1):
+        retry_after = None
+        try:
+            async with limiter:
+                start_time = time.monotonic()
+                try:
+                    digest = await fetch_to_store(session, url, store)
+                except (HTTPStatusError, asyncio.TimeoutError) as e:
+                    if isinstance(e, asyncio.TimeoutError) or e.retryable:
+                        limiter.on_congestion()
+                    raise
+                limiter.on_success(time.monotonic() - start_time)
+                return digest
+        except HTTPStatusError as e:
+            if not e.retryable or attempt == retries:
+                raise
+            retry_after = e.retry_after
+        except (asyncio.TimeoutError, aiohttp.ClientError):
+            if attempt == retries:
+                raise
+        
+        # Экспоненциальная задержка с полным джиттером, Retry-After имеет приоритет
+        delay = retry_after if retry_after is not None else random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+        await asyncio.sleep(delay)
+    
+    raise RuntimeError("попытки закончились")
+
+
+def process_image(source: str, thumbnail: str, thumbnail_size: Tuple[int, int]) -> Dict:
+    """Проверка JPEG, миниатюра и разностный перцептивный хэш (dHash 8x8); выполняется в отдельном процессе"""
+    from PIL import Image
+    
+    with Image.open(source) as image:
+        image.verify()
+    
+    with Image.open(source) as image:
+        image_format = image.format
+        width, height = image.size
+        image = image.convert('RGB')
+        
+        gray = image.convert('L').resize((9, 8))
+        pixels = gray.tobytes()
+        bits = 0
+        for row in range(8):
+            for col in range(8):
+                bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+        
+        image.thumbnail(thumbnail_size)
+        image.save(thumbnail, 'JPEG', quality=85)
+    
+    return {'format': image_format, 'width': width, 'height': height, 'dhash': f"{bits:016x}"}
+
+
+class ImageProcessor:
+    """Обработка скачанных файлов в ProcessPoolExecutor параллельно с загрузкой.
+    
+    Каждый уникальный объект хранилища обрабатывается один раз. Не больше
+    max_pending файлов ждут обработки одновременно: загрузчики, которые хотят
+    отправить еще, ждут освобождения места, поэтому память не растет.
+    """
+    
+    def __init__(self, output_dir: Path, workers: Optional[int] = None, max_pending: int = 32,
+                 thumbnail_size: Tuple[int, int] = (160, 120)):
+        self.thumbnails_dir = output_dir / "thumbnails"
+        self.thumbnails_dir.mkdir(parents=True, exist_ok=True)
+        self.results_file = output_dir / "processed.jsonl"
+        self.thumbnail_size = thumbnail_size
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.slots = asyncio.Semaphore(max_pending)
+        self.tasks: Set[asyncio.Task] = set()
+        self.seen: Set[str] = set()
+        self.valid = 0
+        self.invalid = 0
+        
+        if self.results_file.exists():
+            with open(self.results_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        self.seen.add(json.loads(line)['sha256'])
+                    except (ValueError, KeyError):
+                        continue
+        self._results = open(self.results_file, 'a', encoding='utf-8')
+    
+    async def submit(self, digest: str, path: Path) -> None:
+        if digest in self.seen:
+            return
+        self.seen.add(digest)
+        
+        await self.slots.acquire()
+        loop = asyncio.get_running_loop()
+        thumbnail = self.thumbnails_dir / f"{digest}.jpg"
+        future = loop.run_in_executor(self.executor, process_image, str(path), str(thumbnail), self.thumbnail_size)
+        task = asyncio.create_task(self._collect(digest, future))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+    
+    async def _collect(self, digest: str, future: asyncio.Future) -> None:
+        try:
+            result = await future
+            self.valid += 1
         except Exception as e:
-            print(f"Ошибка при загрузке изображения {image_id}: {e}")
-            return False
+            result = {'error': str(e)}
+            self.invalid += 1
+        finally:
+            self.slots.release()
+        
+        self._results.write(json.dumps({'sha256': digest, **result}, ensure_ascii=False) + "\n")
+    
+    async def close(self) -> None:
+        if self.tasks:
+            await asyncio.gather(*self.tasks)
+        self.executor.shutdown(wait=True)
+        self._results.close()
 
 
-async def download_images(count: int, output_dir: Path, max_concurrent: int = 10) -> None:
-    output_dir.mkdir(parents=True, exist_ok=True)
+async def download_image(session: aiohttp.ClientSession, image_id: int, output_dir: Path, store: ImageStore,
+                         limiters: HostLimiters, base_url: str = DEFAULT_BASE_URL,
+                         processor: Optional[ImageProcessor] = None) -> Optional[bool]:
+    """Возвращает True при загрузке, None если файл уже был готов, False при ошибке"""
+    url = f"{base_url}/id/{image_id % 1000}/800/600"
+    filename = output_dir / f"image_{image_id}.jpg"
     
-    semaphore = asyncio.Semaphore(max_concurrent)
+    digest = store.is_complete(filename, url)
+    if digest is not None:
+        if processor is not None:
+            await processor.submit(digest, store.object_path(digest))
+        return None
     
-    connector = aiohttp.TCPConnector(limit=max_concurrent)
+    try:
+        digest = await store.get_object(url, lambda u: fetch_with_retry(session, u, store, limiters))
+        store.link_file(filename, url, digest)
+        if processor is not None:
+            await processor.submit(digest, store.object_path(digest))
+        return True
+    except Exception as e:
+        print(f"Ошибка при загрузке изображения {image_id}: {e}")
+        return False
+
+
+@dataclass
+class DownloadStats:
+    """Итоги загрузки, накапливаются по мере завершения задач"""
+    successful: int = 0
+    failed: int = 0
+    skipped: int = 0
+
+
+async def download_worker(session: aiohttp.ClientSession, image_ids: Iterator[int], output_dir: Path,
+                          store: ImageStore, limiters: HostLimiters, stats: DownloadStats, base_url: str,
+                          processor: Optional[ImageProcessor] = None) -> None:
+    for image_id in image_ids:
+        result = await download_image(session, image_id, output_dir, store, limiters, base_url, processor)
+        if result is None:
+            stats.skipped += 1
+        elif result:
+            stats.successful += 1
+        else:
+            stats.failed += 1
+
+
+async def download_images(count: int, output_dir: Path, max_concurrent: int = 64, initial_concurrent: int = 4,
+                          base_url: str = DEFAULT_BASE_URL, connector_limit: Optional[int] = None,
+                          trace_configs: Optional[List[aiohttp.TraceConfig]] = None,
+                          write_mode: str = "buffered", process: bool = False) -> DownloadStats:
+    output_dir.mkdir(parents=True, exist_ok=True)
+    
+    connector = aiohttp.TCPConnector(limit=max_concurrent if connector_limit is None else connector_limit)
     timeout = aiohttp.ClientTimeout(total=30)
     headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
     
-    async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers) as session:
-        tasks = [
-            download_image(session, i, output_dir, semaphore)
-            for i in range(count)
-        ]
-        
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers,
+                                     trace_configs=trace_configs) as session:
+        # Воркеры разбирают общий ленивый итератор, поэтому в памяти
+        # одновременно находится не больше max_concurrent задач; сколько из
+        # них реально отправляют запросы, решает AdaptiveLimiter хоста
+        image_ids = iter(range(count))
+        stats = DownloadStats()
+        writer = BufferedFileWriter() if write_mode == "buffered" else None
+        store = ImageStore(output_dir / ".store", writer)
+        limiters = HostLimiters(initial_concurrent, max_concurrent)
+        processor = ImageProcessor(output_dir) if process else None
+        try:
+            workers = [
+                asyncio.create_task(download_worker(session, image_ids, output_dir, store, limiters, stats, base_url, processor))
+                for _ in range(min(max_concurrent, count))
+            ]
+            
+            await asyncio.gather(*workers)
+        finally:
+            store.close()
+            if processor is not None:
+                await processor.close()
         
-        successful = sum(1 for r in results if r is True)
-        print(f"\nЗагружено успешно: {successful} из {count} изображений")
+        print(f"\nЗагружено успешно: {stats.successful} из {count} изображений")
+        print(f"Пропущено уже загруженных: {stats.skipped}, уникальных URL в хранилище: {len(store.urls)}")
+        for host, limiter in limiters.limiters.items():
+            print(f"Итоговый лимит одновременных запросов к {host}: {int(limiter.limit)}")
+        if processor is not None:
+            print(f"Обработано изображений: {processor.valid}, не прошли проверку: {processor.invalid}")
         print(f"Изображения сохранены в: {output_dir.absolute()}")
+    
+    return stats
 
 
 def main():
@@ -73,8 +572,31 @@ def main():
     parser.add_argument(
         "-c", "--concurrent",
         type=int,
-        default=10,
-        help="Максимальное количество одновременных загрузок (по умолчанию: 10)"
+        default=64,
+        help="Верхняя граница одновременных загрузок на хост, фактический лимит подбирается автоматически (по умолчанию: 64)"
+    )
+    parser.add_argument(
+        "--base-url",
+        type=str,
+        default=DEFAULT_BASE_URL,
+        help=f"Адрес сервера изображений, например локального mock_image_server.py (по умолчанию: {DEFAULT_BASE_URL})"
+    )
+    parser.add_argument(
+        "--write-mode",
+        choices=["buffered", "aiofiles"],
+        default="buffered",
+        help="Запись файлов: крупными блоками через отдельный пул потоков или по 8 КБ через aiofiles (по умолчанию: buffered)"
+    )
+    parser.add_argument(
+        "--process",
+        action="store_true",
+        help="Параллельно с загрузкой проверять JPEG, делать миниатюры и перцептивные хэши в пуле процессов (нужен Pillow)"
+    )
+    parser.add_argument(
+        "--start-concurrent",
+        type=int,
+        default=4,
+        help="Начальный лимит одновременных загрузок на хост (по умолчанию: 4)"
     )
     
     args = parser.parse_args()
@@ -84,7 +606,15 @@ def main():
     print(f"Начинаем загрузку {args.count} изображений...")
     start_time = time.time()
     
-    asyncio.run(download_images(args.count, output_dir, args.concurrent))
+    asyncio.run(download_images(
+        args.count,
+        output_dir,
+        args.concurrent,
+        args.start_concurrent,
+        args.base_url,
+        write_mode=args.write_mode,
+        process=args.process
+    ))
     
     elapsed_time = time.time() - start_time
     print(f"Время выполнения: {elapsed_time:.2f} секунд")
@@ -5,22 +5,403 @@
 
 import asyncio
 import aiohttp
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, Tag
 import json
 from pathlib import Path
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import Any, Callable, Iterator, List, Dict, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
 import argparse
+import itertools
+import os
 import time
 import hashlib
+import re
+from dataclasses import dataclass, field
+from urllib.parse import urlencode, urlsplit
+
+from listing_store import ListingStore
+from scrape_scheduler import AdaptiveScheduler
+from seen_index import SeenIndex
+from task_5_1 import parse_retry_after
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:
+    try:
+        from selectolax.parser import HTMLParser
+    except ImportError:
+        HTMLParser = None
+
+try:
+    from lxml import html as lxml_html
+except ImportError:
+    lxml_html = None
+
+
+YANDEX_BASE_URL = "https://realty.yandex.ru"
+MAX_OFFER_LINKS = 30
+MAX_LISTINGS = 20
+MAX_PAGES = 25
+MAX_PAGE_ATTEMPTS = 3
+
+REGION_TAIL = 2048
+# первое число цены: группы цифр через пробел/NBSP, дробная часть и множитель
+PRICE_RE = re.compile(r'(\d{1,3}(?:[ \u00a0\u2009\u202f]\d{3})+|\d+)(?:[.,](\d+))?\s*(млн|тыс)?', re.I)
+PRICE_MULTIPLIERS = {'млн': 1_000_000, 'тыс': 1_000}
+ROOMS_RE = re.compile(r'(\d+)\s*-?\s*(?:комн|к\.|к\b|-?x\b)', re.I)
+SCRIPT_RE = re.compile(r'<(script|style)\b.*?</\1>', re.S | re.I)
+
+CITY_SLUGS = {
+    'moskva': 'moskva',
+    'spb': 'sankt-peterburg',
+    'ekaterinburg': 'ekaterinburg'
+}
+
+# Элемент документа: (ключ, тег, атрибуты, ключ родителя, узел)
+Element = Tuple[Any, str, Dict, Any, Any]
+
+
+def available_backends() -> List[str]:
+    backends = []
+    if HTMLParser is not None:
+        backends.append('selectolax')
+    if lxml_html is not None:
+        backends.append('lxml')
+    backends.append('html.parser')
+    return backends
+
+
+def default_backend() -> str:
+    return available_backends()[0]
+
+
+def _walk_selectolax(html: str) -> Tuple[Iterator[Element], Callable[[Any], str]]:
+    tree = HTMLParser(html)
+    
+    def elements():
+        for node in tree.root.traverse():
+            parent = node.parent
+            yield node.mem_id, node.tag, node.attributes, parent.mem_id if parent is not None else None, node
+    
+    return elements(), lambda node: node.text(deep=True, separator='', strip=True)
+
+
+def _walk_lxml(html: str) -> Tuple[Iterator[Element], Callable[[Any], str]]:
+    root = lxml_html.document_fromstring(html)
+    
+    def elements():
+        for element in root.iter():
+            if isinstance(element.tag, str):
+                yield element, element.tag, element.attrib, element.getparent(), element
+    
+    return elements(), lambda node: ''.join(part.strip() for part in node.itertext())
+
+
+def _walk_bs4(html: str) -> Tuple[Iterator[Element], Callable[[Any], str]]:
+    soup = BeautifulSoup(html, 'html.parser')
+    
+    def elements():
+        for node in soup.descendants:
+            if isinstance(node, Tag):
+                yield id(node), node.name, node.attrs, id(node.parent), node
+    
+    return elements(), lambda node: node.get_text(strip=True)
+
+
+WALKERS = {
+    'selectolax': _walk_selectolax,
+    'lxml': _walk_lxml,
+    'html.parser': _walk_bs4,
+}
+
+
+def _class_contains(attrs: Dict, word: str) -> bool:
+    value = attrs.get('class')
+    if not value:
+        return False
+    if not isinstance(value, str):
+        value = ' '.join(value)
+    return word in value.lower()
+
+
+def _classify(tag: str, attrs: Dict) -> Optional[Tuple[str, int]]:
+    """Роль элемента в карточке объявления и ее приоритет (меньше - важнее)"""
+    data_test = attrs.get('data-test')
+    if tag == 'span' and data_test == 'title':
+        return 'title', 0
+    if tag == 'h3':
+        return 'title', 1
+    if tag == 'a' and _class_contains(attrs, 'title'):
+        return 'title', 2
+    if tag == 'span' and data_test == 'price':
+        return 'price', 0
+    if tag == 'div' and _class_contains(attrs, 'price'):
+        return 'price', 1
+    if tag == 'span' and _class_contains(attrs, 'price'):
+        return 'price', 2
+    return None
+
+
+def parse_yandex_listings(html: str, backend: Optional[str] = None, max_links: Optional[int] = MAX_OFFER_LINKS,
+                          max_listings: Optional[int] = MAX_LISTINGS) -> List[Dict]:
+    """Извлечение объявлений за один проход по документу.
+    
+    Ссылки на объявления запоминаются вместе с ближайшим div/article, а
+    кандидаты в заголовок и цену сразу приписываются всем своим div/article
+    предкам, поэтому повторные поиски по поддеревьям не нужны. Ссылка без
+    таких предков, как и раньше, ищет заголовок и цену внутри себя.
+    """
+    elements, text_of = WALKERS[backend or default_backend()](html)
+    
+    parents: Dict[Any, Tuple[str, Any]] = {}
+    links = []
+    best: Dict[Any, Dict[str, Tuple[int, Any]]] = {}
+    
+    for key, tag, attrs, parent_key, node in elements:
+        parents[key] = (tag, parent_key)
+        
+        if tag == 'a':
+            href = attrs.get('href') or ''
+            if '/offer/' in href and (max_links is None or len(links) < max_links):
+                links.append((href, key, node))
+        
+        role = _classify(tag, attrs)
+        if role is None:
+            continue
+        kind, priority = role
+        ancestor = parent_key
+        while ancestor in parents:
+            ancestor_tag, next_ancestor = parents[ancestor]
+            if ancestor_tag in ('div', 'article', 'a'):
+                slots = best.setdefault(ancestor, {})
+                if kind not in slots or priority < slots[kind][0]:
+                    slots[kind] = (priority, node)
+            ancestor = next_ancestor
+    
+    listings = []
+    seen_offers = set()
+    scraped_at = datetime.now().isoformat()
+    for href, key, node in links:
+        link = href if href.startswith('http') else f"{YANDEX_BASE_URL}{href}"
+        if link in seen_offers:
+            continue
+        seen_offers.add(link)
+        
+        container = None
+        nearest_article = None
+        ancestor = parents[key][1]
+        while ancestor in parents:
+            ancestor_tag, next_ancestor = parents[ancestor]
+            if ancestor_tag == 'div':
+                container = ancestor
+                break
+            if ancestor_tag == 'article' and nearest_article is None:
+                nearest_article = ancestor
+            ancestor = next_ancestor
+        if container is None:
+            container = nearest_article if nearest_article is not None else key
+        slots = best.get(container, {})
+        
+        title = text_of(slots['title'][1]) if 'title' in slots else text_of(node)
+        price = text_of(slots['price'][1]) if 'price' in slots else "Не указана"
+        
+        listings.append({
+            # id - от исходного заголовка, как у уже сохраненных объявлений
+            'id': _generate_id(link, title),
+            'source': 'yandex',
+            'title': title or "Объявление",
+            'price': price,
+            'price_value': parse_price(price),
+            'rooms': parse_rooms(title or ""),
+            'url': link,
+            'scraped_at': scraped_at
+        })
+        
+        if max_listings is not None and len(listings) >= max_listings:
+            break
+    
+    return listings
+
+
+def page_region_hash(html: str) -> Optional[str]:
+    """Хэш области выдачи: от первой до последней ссылки на объявление плюс REGION_TAIL символов.
+    
+    Шапка, подвал и скрипты (счетчики, токены) меняются при каждой загрузке,
+    поэтому в хэш не попадают. None, если на странице нет объявлений.
+    """
+    start = html.find('/offer/')
+    if start < 0:
+        return None
+    last = html.rfind('/offer/')
+    end = last + REGION_TAIL
+    footer = html.find('<footer', last, end)
+    if footer >= 0:
+        end = footer
+    region = SCRIPT_RE.sub('', html[start:end])
+    return hashlib.blake2b(region.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class PageCache:
+    """ETag, Last-Modified и хэш области выдачи для каждого URL, хранится в JSON.
+    
+    Новые записи применяются через commit() только после сохранения
+    объявлений со страниц: иначе при сбое сохранения страница в следующий
+    раз ответила бы 304 и ее объявления не были бы доставлены никогда.
+    """
+    
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries: Dict[str, Dict[str, str]] = {}
+        if path.exists():
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Ошибка при загрузке {path}: {e}")
+    
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        entry = self.entries.get(url, {})
+        headers = {}
+        if 'etag' in entry:
+            headers['If-None-Match'] = entry['etag']
+        if 'last_modified' in entry:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+    
+    def region_hash(self, url: str) -> Optional[str]:
+        return self.entries.get(url, {}).get('hash')
+    
+    @staticmethod
+    def entry(validators: Dict[str, str], region_hash: Optional[str]) -> Dict[str, str]:
+        entry = dict(validators)
+        if region_hash is not None:
+            entry['hash'] = region_hash
+        return entry
+    
+    def commit(self, updates: Dict[str, Dict[str, str]]):
+        if updates:
+            self.entries.update(updates)
+            self.save()
+    
+    def save(self):
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+def parse_price(text: Optional[str]) -> Optional[int]:
+    """Цена в рублях по первому числу строки: '45 000 ₽/мес.', 'от 30 000 до 45 000 ₽', '1,2 млн ₽'.
+    
+    Дополнительные суммы ('+ КУ 3 000 ₽') отбрасываются; None, если числа нет.
+    """
+    if not text:
+        return None
+    match = PRICE_RE.search(text)
+    if match is None:
+        return None
+    integer, fraction, unit = match.groups()
+    value = int(re.sub(r'\D', '', integer))
+    multiplier = PRICE_MULTIPLIERS.get(unit.lower(), 1) if unit else 1
+    if fraction and multiplier > 1:
+        return value * multiplier + int(fraction) * multiplier // 10 ** len(fraction)
+    return value * multiplier
+
+
+def parse_rooms(title: str) -> Optional[int]:
+    """Число комнат из заголовка ('2-комнатная', '3-к. квартира'); студия - 0"""
+    if 'студи' in title.lower():
+        return 0
+    match = ROOMS_RE.search(title)
+    return int(match.group(1)) if match else None
+
+
+def _generate_id(url: str, title: str) -> str:
+    content = f"{url}{title}".encode('utf-8')
+    return hashlib.md5(content).hexdigest()
+
+
+@dataclass(frozen=True)
+class SearchQuery:
+    city: str = "moskva"
+    rooms: Optional[int] = None
+    max_price: Optional[int] = None
+    
+    def url(self, page: int = 0, base_url: str = YANDEX_BASE_URL) -> str:
+        params = {}
+        if self.rooms is not None:
+            params['roomsTotal'] = self.rooms
+        if self.max_price is not None:
+            params['priceMax'] = self.max_price
+        if page > 0:
+            params['page'] = page
+        url = f"{base_url}/{CITY_SLUGS.get(self.city, self.city)}/snyat/kvartira/"
+        return f"{url}?{urlencode(params)}" if params else url
+
+
+class HostRateLimiter:
+    """Не больше rate запросов в секунду к каждому хосту, пачкой до burst запросов.
+    
+    Для хоста хранится время следующего свободного слота; запрос занимает
+    слот и ждет его наступления. Ответ 429 сдвигает слоты хоста на Retry-After.
+    """
+    
+    def __init__(self, rate: float = 5.0, burst: int = 1):
+        self.interval = 1 / rate
+        self.burst = burst
+        self.next_slot: Dict[str, float] = {}
+    
+    async def acquire(self, url: str):
+        host = urlsplit(url).netloc
+        now = time.monotonic()
+        slot = max(now - (self.burst - 1) * self.interval, self.next_slot.get(host, now))
+        self.next_slot[host] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+    
+    def pause(self, url: str, delay: float):
+        host = urlsplit(url).netloc
+        self.next_slot[host] = max(self.next_slot.get(host, 0.0), time.monotonic() + delay)
+
+
+@dataclass
+class CrawlState:
+    """Страницы одного запроса: сколько уже поставлено в очередь и где выдача закончилась"""
+    query: SearchQuery
+    next_page: int = 0
+    stop_page: float = float('inf')
+    pages_fetched: int = 0
+    listings: List[Dict] = field(default_factory=list)
 
 
 class RentalScraper:
 
-    def __init__(self, output_dir: Path = Path("data")):
+    def __init__(self, output_dir: Path = Path("data"), parser_backend: Optional[str] = None,
+                 parse_workers: Optional[int] = None, concurrency: int = 8, rate: float = 5.0,
+                 max_pages: int = MAX_PAGES, page_window: int = 2, base_url: str = YANDEX_BASE_URL,
+                 bloom_capacity: Optional[int] = None, compress: bool = False):
         self.output_dir = output_dir
         self.output_dir.mkdir(parents=True, exist_ok=True)
         self.session: Optional[aiohttp.ClientSession] = None
+        self.parser_backend = parser_backend or default_backend()
+        self.parse_workers = parse_workers
+        self.parse_executor: Optional[ProcessPoolExecutor] = None
+        self.concurrency = concurrency
+        self.max_pages = max_pages
+        self.page_window = page_window
+        self.base_url = base_url
+        self.rate_limiter = HostRateLimiter(rate, burst=min(concurrency, page_window))
+        self.page_cache = PageCache(self.output_dir / "page_cache.json")
+        self.page_stats = {'parsed': 0, 'not_modified': 0, 'unchanged': 0}
+        self.store = ListingStore(self.output_dir / "listings", compress)
+        if not self.store.segments():
+            # первый запуск с хранилищем: один раз переносим старые снимки listings_*.json
+            for listings in self._legacy_snapshots():
+                self.store.append(listings)
+        self.seen_index = SeenIndex(self.output_dir / "seen_ids.bin", bloom_capacity)
+        if not self.seen_index.existed:
+            self.seen_index.add_many(listing['id'] for listing in self.store.iter_records() if 'id' in listing)
         
     async def __aenter__(self):
         base_headers = {
@@ -37,139 +418,287 @@ class RentalScraper:
             'Cache-Control': 'max-age=0',
             'DNT': '1'
         }
-        connector = aiohttp.TCPConnector(limit=10, force_close=False)
+        connector = aiohttp.TCPConnector(limit=max(10, self.concurrency), force_close=False)
         timeout = aiohttp.ClientTimeout(total=60, connect=10)
         cookie_jar = aiohttp.CookieJar(unsafe=True)
         self.session = aiohttp.ClientSession(headers=base_headers, connector=connector, timeout=timeout, cookie_jar=cookie_jar)
+        self.parse_executor = ProcessPoolExecutor(max_workers=self.parse_workers)
         return self
         
     async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.page_cache.save()
         if self.session:
             await self.session.close()
+        if self.parse_executor:
+            self.parse_executor.shutdown(wait=True)
     
     def _generate_id(self, url: str, title: str) -> str:
-        content = f"{url}{title}".encode('utf-8')
-        return hashlib.md5(content).hexdigest()
+        return _generate_id(url, title)
     
-    async def scrape_yandex(self, city: str = "moskva", rooms: Optional[int] = None, max_price: Optional[int] = None) -> List[Dict]:
+    async def parse_listings(self, html: str, max_links: Optional[int] = MAX_OFFER_LINKS,
+                             max_listings: Optional[int] = MAX_LISTINGS) -> List[Dict]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.parse_executor, parse_yandex_listings, html, self.parser_backend, max_links, max_listings
+        )
+    
+    async def fetch_page(self, url: str, headers: Optional[Dict[str, str]] = None) -> Tuple[int, Optional[str], Dict[str, str]]:
+        """Статус (200, 304 или 404), HTML и валидаторы ETag/Last-Modified. 429 и 5xx повторяются"""
+        for attempt in range(MAX_PAGE_ATTEMPTS):
+            await self.rate_limiter.acquire(url)
+            async with self.session.get(url, allow_redirects=True, headers=headers) as response:
+                validators = {}
+                if 'ETag' in response.headers:
+                    validators['etag'] = response.headers['ETag']
+                if 'Last-Modified' in response.headers:
+                    validators['last_modified'] = response.headers['Last-Modified']
+                if response.status == 200:
+                    return 200, await response.text(), validators
+                if response.status in (304, 404):
+                    return response.status, None, validators
+                if response.status != 429 and response.status < 500:
+                    raise aiohttp.ClientResponseError(
+                        response.request_info, response.history, status=response.status, message=f"статус {response.status}"
+                    )
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                delay = retry_after if retry_after is not None else 2 ** attempt
+                self.rate_limiter.pause(url, delay)
+        raise RuntimeError(f"страница недоступна после {MAX_PAGE_ATTEMPTS} попыток")
+    
+    async def _crawl_worker(self, tasks: asyncio.Queue, known_ids, crawled_ids: set, incremental: bool,
+                            page_updates: Dict[str, Dict[str, str]]):
+        while True:
+            state, page = await tasks.get()
+            try:
+                if page >= state.stop_page:
+                    continue
+                url = state.query.url(page, self.base_url)
+                try:
+                    headers = self.page_cache.conditional_headers(url) if incremental else None
+                    status, html, validators = await self.fetch_page(url, headers)
+                    state.pages_fetched += 1
+                    if status == 304:
+                        # все объявления страницы уже обработаны в прошлый раз
+                        self.page_stats['not_modified'] += 1
+                        state.stop_page = min(state.stop_page, page)
+                        continue
+                    
+                    region_hash = page_region_hash(html) if html is not None else None
+                    if incremental and region_hash is not None and region_hash == self.page_cache.region_hash(url):
+                        self.page_stats['unchanged'] += 1
+                        page_updates[url] = PageCache.entry(validators, region_hash)
+                        state.stop_page = min(state.stop_page, page)
+                        continue
+                    
+                    listings = await self.parse_listings(html, None, None) if region_hash is not None else []
+                    self.page_stats['parsed'] += 1
+                    page_updates[url] = PageCache.entry(validators, region_hash)
+                except Exception as e:
+                    print(f"Ошибка при скрапинге {url}: {e}")
+                    state.stop_page = min(state.stop_page, page)
+                    continue
+                
+                new_listings = [
+                    listing for listing in listings
+                    if listing['id'] not in crawled_ids and listing['id'] not in known_ids
+                ]
+                if not new_listings:
+                    # пустая страница или только известные объявления - дальше выдача уже просмотрена
+                    state.stop_page = min(state.stop_page, page)
+                    continue
+                for listing in new_listings:
+                    listing.setdefault('city', state.query.city)
+                crawled_ids.update(listing['id'] for listing in new_listings)
+                state.listings.extend(new_listings)
+                
+                if state.next_page < min(self.max_pages, state.stop_page):
+                    tasks.put_nowait((state, state.next_page))
+                    state.next_page += 1
+            finally:
+                tasks.task_done()
+    
+    async def crawl(self, queries: List[SearchQuery], known_ids=None) -> List[Dict]:
         listings = []
+        for query_listings in (await self.crawl_by_query(queries, known_ids)).values():
+            listings.extend(query_listings)
+        return listings
+    
+    async def crawl_by_query(self, queries: List[SearchQuery], known_ids=None) -> Dict[SearchQuery, List[Dict]]:
+        listings_by_query, _ = await self.crawl_pages(queries, known_ids)
+        return listings_by_query
+    
+    async def crawl_pages(self, queries: List[SearchQuery], known_ids=None) -> Tuple[Dict[SearchQuery, List[Dict]], Dict[str, Dict[str, str]]]:
+        """Обход страниц выдачи для всех запросов пулом из concurrency воркеров.
         
-        city_map = {
-            'moskva': 'moskva',
-            'spb': 'sankt-peterburg',
-            'ekaterinburg': 'ekaterinburg'
-        }
-        city_slug = city_map.get(city, city)
+        Для каждого запроса заранее запрашивается page_window страниц; каждая
+        страница с новыми объявлениями добавляет в очередь следующую. Обход
+        запроса прекращается на первой странице без новых объявлений.
+        
+        С known_ids обход инкрементальный: страницы запрашиваются с
+        If-None-Match/If-Modified-Since, а ответ 304 или страница с прежним
+        хэшем области выдачи считаются страницей без новых объявлений.
+        known_ids - любой контейнер с in (множество или SeenIndex), не копируется.
         
-        url = f"https://realty.yandex.ru/{city_slug}/snyat/kvartira/"
+        Возвращает объявления по запросам и новые записи для page_cache,
+        которые нужно передать в commit_pages() после сохранения объявлений.
+        """
+        incremental = known_ids is not None
+        known_ids = known_ids if incremental else ()
+        crawled_ids: set = set()
+        page_updates: Dict[str, Dict[str, str]] = {}
+        tasks: asyncio.Queue = asyncio.Queue()
+        states = [CrawlState(query) for query in queries]
+        for state in states:
+            for _ in range(min(self.page_window, self.max_pages)):
+                tasks.put_nowait((state, state.next_page))
+                state.next_page += 1
         
+        workers = [asyncio.create_task(self._crawl_worker(tasks, known_ids, crawled_ids, incremental, page_updates)) for _ in range(self.concurrency)]
         try:
-            await asyncio.sleep(0.5)
-            async with self.session.get(url, allow_redirects=True) as response:
-                if response.status == 200:
-                    html = await response.text()
-                    soup = BeautifulSoup(html, 'html.parser')
-                    
-                    offer_links = soup.find_all('a', href=lambda x: x and '/offer/' in x)
-                    seen_offers = set()
-                    
-                    for link_elem in offer_links[:30]:
-                        try:
-                            link = link_elem.get('href', '')
-                            if not link.startswith('http'):
-                                link = f"https://realty.yandex.ru{link}"
-                            
-                            if link in seen_offers:
-                                continue
-                            seen_offers.add(link)
-                            
-                            parent = link_elem.find_parent('div') or link_elem.find_parent('article')
-                            if not parent:
-                                parent = link_elem
-                            
-                            title_elem = parent.find('span', {'data-test': 'title'}) or parent.find('h3') or parent.find('a', class_=lambda x: x and 'title' in str(x).lower()) or link_elem
-                            title = title_elem.get_text(strip=True) if title_elem else "Объявление"
-                            
-                            price_elem = parent.find('span', {'data-test': 'price'}) or parent.find('div', class_=lambda x: x and 'price' in str(x).lower()) or parent.find('span', class_=lambda x: x and 'price' in str(x).lower())
-                            price = price_elem.get_text(strip=True) if price_elem else "Не указана"
-                            
-                            listing_id = self._generate_id(link, title)
-                            
-                            listings.append({
-                                'id': listing_id,
-                                'source': 'yandex',
-                                'title': title,
-                                'price': price,
-                                'url': link,
-                                'scraped_at': datetime.now().isoformat()
-                            })
-                            
-                            if len(listings) >= 20:
-                                break
-                        except Exception as e:
-                            continue
-                else:
-                    print(f"Ошибка при запросе: статус {response.status}")
-        except Exception as e:
-            print(f"Ошибка при скрапинге: {e}")
+            await tasks.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
         
-        return listings
+        return {state.query: state.listings for state in states}, page_updates
+    
+    async def scrape_yandex(self, city: str = "moskva", rooms: Optional[int] = None, max_price: Optional[int] = None) -> List[Dict]:
+        return await self.crawl([SearchQuery(city, rooms, max_price)])
     
     async def scrape(self, city: str = "moskva", rooms: Optional[int] = None, max_price: Optional[int] = None) -> List[Dict]:
         return await self.scrape_yandex(city, rooms, max_price)
     
-    def save_listings(self, listings: List[Dict], filename: Optional[str] = None) -> Path:
-        if filename is None:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"listings_{timestamp}.json"
-        
-        filepath = self.output_dir / filename
+    def save_listings(self, listings: List[Dict], filename: Optional[str] = None) -> Optional[Path]:
+        """Дописать в хранилище еще не виденные объявления; с filename - выгрузить все в отдельный JSON файл.
         
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(listings, f, ensure_ascii=False, indent=2)
+        Возвращает путь файла или None, если новых объявлений не было.
+        """
+        if filename is not None:
+            filepath = self.output_dir / filename
+            with open(filepath, 'w', encoding='utf-8') as f:
+                json.dump(listings, f, ensure_ascii=False, indent=2)
+        else:
+            new_ids = set()
+            new_listings = []
+            for listing in listings:
+                listing_id = listing.get('id')
+                if listing_id in new_ids or (listing_id is not None and listing_id in self.seen_index):
+                    continue
+                new_ids.add(listing_id)
+                new_listings.append(listing)
+            filepath = self.store.append(new_listings)
         
+        self.mark_seen(listings)
         return filepath
     
-    def load_existing_ids(self) -> set:
-        existing_ids = set()
-        
-        for filepath in self.output_dir.glob("listings_*.json"):
+    def iter_listings(self, unique: bool = True) -> Iterator[Dict]:
+        return self.store.iter_records(unique)
+    
+    async def compact_store(self) -> Tuple[int, int]:
+        return await asyncio.to_thread(self.store.compact)
+    
+    def mark_seen(self, listings: List[Dict]) -> int:
+        return self.seen_index.add_many(listing['id'] for listing in listings if 'id' in listing)
+    
+    def load_existing_ids(self) -> SeenIndex:
+        return self.seen_index
+    
+    def _legacy_snapshots(self) -> Iterator[List[Dict]]:
+        for filepath in sorted(self.output_dir.glob("listings_*.json")):
             try:
                 with open(filepath, 'r', encoding='utf-8') as f:
                     data = json.load(f)
                     if isinstance(data, list):
-                        for listing in data:
-                            if 'id' in listing:
-                                existing_ids.add(listing['id'])
+                        yield data
             except Exception as e:
                 print(f"Ошибка при загрузке {filepath}: {e}")
-        
-        return existing_ids
     
-    async def find_new_listings(self, city: str = "moskva", rooms: Optional[int] = None, max_price: Optional[int] = None) -> List[Dict]:
-        existing_ids = self.load_existing_ids()
-        all_listings = await self.scrape(city, rooms, max_price)
+    async def find_new_listings(self, city: str = "moskva", rooms: Optional[int] = None, max_price: Optional[int] = None,
+                                queries: Optional[List[SearchQuery]] = None) -> List[Dict]:
+        """Новые объявления; страницы не запоминаются в page_cache (см. find_new_listings_by_query)"""
+        new_listings = []
+        new_by_query, _ = await self.find_new_listings_by_query(queries or [SearchQuery(city, rooms, max_price)])
+        for query_listings in new_by_query.values():
+            new_listings.extend(query_listings)
+        return new_listings
+    
+    async def find_new_listings_by_query(self, queries: List[SearchQuery]) -> Tuple[Dict[SearchQuery, List[Dict]], Dict[str, Dict[str, str]]]:
+        """Новые объявления по запросам и записи для commit_pages() после их сохранения"""
+        return await self.crawl_pages(queries, self.load_existing_ids())
+    
+    def commit_pages(self, page_updates: Dict[str, Dict[str, str]]):
+        self.page_cache.commit(page_updates)
+
+
+async def periodic_scrape(interval: int = 3600, city: str = "moskva", rooms: Optional[int] = None, max_price: Optional[int] = None,
+                          parser_backend: Optional[str] = None, queries: Optional[List[SearchQuery]] = None,
+                          scraper: Optional[RentalScraper] = None, min_interval: Optional[float] = None,
+                          target_new: float = 1.0):
+    """Проверки по адаптивному расписанию: от min_interval до interval секунд для каждого запроса"""
+    if scraper is None:
+        async with RentalScraper(parser_backend=parser_backend) as scraper:
+            await periodic_scrape(interval, city, rooms, max_price, queries=queries, scraper=scraper,
+                                  min_interval=min_interval, target_new=target_new)
+        return
+    
+    scheduler = AdaptiveScheduler(
+        min_interval=interval if min_interval is None else min_interval,
+        max_interval=interval,
+        target_new=target_new,
+        state_path=scraper.output_dir / "schedule.json"
+    )
+    for query in queries or [SearchQuery(city, rooms, max_price)]:
+        scheduler.add(query)
+    
+    while True:
+        due_queries = await scheduler.next_batch()
+        print(f"\n[{datetime.now()}] Начинаем проверку новых объявлений ({len(due_queries)} запросов)...")
         
-        new_listings = [listing for listing in all_listings if listing['id'] not in existing_ids]
+        segments = len(scraper.store.segments())
+        new_by_query, page_updates = await scraper.find_new_listings_by_query(due_queries)
+        new_listings = []
+        for query in due_queries:
+            query_listings = new_by_query.get(query, [])
+            new_listings.extend(query_listings)
+            next_check = scheduler.record(query, len(query_listings))
+            print(f"  {query}: новых {len(query_listings)}, следующая проверка через {next_check:.0f} секунд")
+        scheduler.save()
+        stats = scraper.page_stats
+        print(f"Страниц разобрано: {stats['parsed']}, не изменилось (304): {stats['not_modified']}, "
+              f"не изменилось (хэш): {stats['unchanged']}")
+        scraper.page_stats = dict.fromkeys(stats, 0)
         
-        return new_listings
+        if new_listings:
+            print(f"Найдено {len(new_listings)} новых объявлений")
+            scraper.save_listings(new_listings)
+        else:
+            print("Новых объявлений не найдено")
+        scraper.commit_pages(page_updates)
+        # закрылся очередной сегмент: закрытые сегменты сливаются в один
+        if segments >= 2 and len(scraper.store.segments()) > segments:
+            before, after = await scraper.compact_store()
+            print(f"Сжатие хранилища: {before} записей -> {after}")
 
 
-async def periodic_scrape(interval: int = 3600, city: str = "moskva", rooms: Optional[int] = None, max_price: Optional[int] = None):
-    async with RentalScraper() as scraper:
-        while True:
-            print(f"\n[{datetime.now()}] Начинаем проверку новых объявлений...")
-            
-            new_listings = await scraper.find_new_listings(city, rooms, max_price)
-            
-            if new_listings:
-                print(f"Найдено {len(new_listings)} новых объявлений")
-                scraper.save_listings(new_listings)
-            else:
-                print("Новых объявлений не найдено")
-            
-            print(f"Следующая проверка через {interval} секунд...")
-            await asyncio.sleep(interval)
+def benchmark_parsers(html: str, repeat: int = 50, workers: Optional[int] = None) -> List[Tuple[str, float, float]]:
+    """Страниц в секунду для каждого парсера: в одном процессе (на ядро) и в пуле процессов"""
+    workers = workers or os.cpu_count() or 1
+    results = []
+    for backend in available_backends():
+        start_time = time.perf_counter()
+        for _ in range(repeat):
+            parse_yandex_listings(html, backend)
+        per_core = repeat / (time.perf_counter() - start_time)
+        
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(parse_yandex_listings, [html] * workers, [backend] * workers))
+            start_time = time.perf_counter()
+            list(executor.map(parse_yandex_listings, [html] * repeat * workers, [backend] * repeat * workers))
+            pooled = repeat * workers / (time.perf_counter() - start_time)
+        
+        results.append((backend, per_core, pooled))
+    return results
 
 
 def main():
@@ -179,20 +708,63 @@ def main():
     parser.add_argument(
         "--city",
         type=str,
-        default="moskva",
-        help="Город для поиска (по умолчанию: moskva)"
+        nargs="+",
+        default=["moskva"],
+        help="Города для поиска (по умолчанию: moskva)"
     )
     parser.add_argument(
         "--rooms",
         type=int,
-        default=None,
-        help="Количество комнат (по умолчанию: все)"
+        nargs="+",
+        default=[None],
+        help="Количество комнат, можно несколько значений (по умолчанию: все)"
     )
     parser.add_argument(
         "--max-price",
         type=int,
+        nargs="+",
+        default=[None],
+        help="Максимальная цена, можно несколько значений (по умолчанию: без ограничений)"
+    )
+    parser.add_argument(
+        "--pages",
+        type=int,
+        default=MAX_PAGES,
+        help=f"Максимум страниц выдачи на один запрос (по умолчанию: {MAX_PAGES})"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=8,
+        help="Количество одновременно загружаемых страниц (по умолчанию: 8)"
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=5.0,
+        help="Максимум запросов в секунду к одному хосту (по умолчанию: 5)"
+    )
+    parser.add_argument(
+        "--bloom-capacity",
+        type=int,
         default=None,
-        help="Максимальная цена (по умолчанию: без ограничений)"
+        help="Хранить виденные ID в фильтре Блума на указанное число объявлений вместо множества"
+    )
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        help="Сжимать новые сегменты хранилища объявлений gzip"
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Слить сегменты хранилища объявлений, убрав повторы, и выйти"
+    )
+    parser.add_argument(
+        "--base-url",
+        type=str,
+        default=YANDEX_BASE_URL,
+        help=f"Адрес сайта (по умолчанию: {YANDEX_BASE_URL})"
     )
     parser.add_argument(
         "--periodic",
@@ -203,20 +775,64 @@ def main():
         "--interval",
         type=int,
         default=3600,
-        help="Интервал между проверками в секундах (по умолчанию: 3600)"
+        help="Максимальный интервал между проверками запроса в секундах (по умолчанию: 3600)"
+    )
+    parser.add_argument(
+        "--min-interval",
+        type=int,
+        default=120,
+        help="Минимальный интервал между проверками запроса в секундах (по умолчанию: 120)"
+    )
+    parser.add_argument(
+        "--target-new",
+        type=float,
+        default=1.0,
+        help="Сколько новых объявлений должно успеть появиться к следующей проверке (по умолчанию: 1)"
+    )
+    parser.add_argument(
+        "--parser",
+        choices=available_backends(),
+        default=default_backend(),
+        help=f"Парсер HTML (по умолчанию: {default_backend()})"
+    )
+    parser.add_argument(
+        "--benchmark-parse",
+        type=str,
+        default=None,
+        metavar="HTML_FILE",
+        help="Замерить скорость разбора сохраненной страницы выдачи всеми доступными парсерами"
     )
     
     args = parser.parse_args()
     
+    if args.benchmark_parse:
+        html = Path(args.benchmark_parse).read_text(encoding='utf-8')
+        print(f"{'Парсер':<14} {'Страниц/сек на ядро':<22} {'Страниц/сек в пуле':<20}")
+        for backend, per_core, pooled in benchmark_parsers(html):
+            print(f"{backend:<14} {per_core:<22.1f} {pooled:<20.1f}")
+        return
+    
+    queries = [
+        SearchQuery(city, rooms, max_price)
+        for city, rooms, max_price in itertools.product(args.city, args.rooms, args.max_price)
+    ]
+    
     async def run_scraper():
-        async with RentalScraper() as scraper:
-            if args.periodic:
-                await periodic_scrape(args.interval, args.city, args.rooms, args.max_price)
+        async with RentalScraper(parser_backend=args.parser, concurrency=args.concurrency, rate=args.rate,
+                                 max_pages=args.pages, base_url=args.base_url,
+                                 bloom_capacity=args.bloom_capacity, compress=args.compress) as scraper:
+            if args.compact:
+                disk_usage = scraper.store.disk_usage()
+                before, after = await scraper.compact_store()
+                print(f"Записей: {before} -> {after}, на диске: {disk_usage} -> {scraper.store.disk_usage()} байт")
+            elif args.periodic:
+                await periodic_scrape(args.interval, queries=queries, scraper=scraper,
+                                      min_interval=args.min_interval, target_new=args.target_new)
             else:
                 print("Начинаем скрапинг Яндекс.Недвижимость...")
                 start_time = time.time()
                 
-                listings = await scraper.scrape(args.city, args.rooms, args.max_price)
+                listings = await scraper.crawl(queries)
                 
                 elapsed_time = time.time() - start_time
                 print(f"\nНайдено объявлений: {len(listings)}")
@@ -224,7 +840,10 @@ def main():
                 
                 if listings:
                     filepath = scraper.save_listings(listings)
-                    print(f"Объявления сохранены в: {filepath}")
+                    if filepath is not None:
+                        print(f"Объявления сохранены в: {filepath}")
+                    else:
+                        print("Новых объявлений нет, хранилище не изменилось")
     
     asyncio.run(run_scraper())
 
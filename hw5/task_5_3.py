@@ -5,16 +5,20 @@
 """
 
 import asyncio
+import bisect
 import json
 import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
-from typing import List, Dict, Optional, Set
-from dataclasses import dataclass, asdict
+from typing import Callable, List, Dict, Optional, Set
+from dataclasses import dataclass
 from aiogram import Bot, Dispatcher, types
+from aiogram.exceptions import TelegramRetryAfter
 from aiogram.filters import Command
 from aiogram.types import Message
-import aiofiles
 
 
 @dataclass
@@ -35,107 +39,609 @@ class Listing:
     price: str
     url: str
     scraped_at: str
+    city: Optional[str] = None
+    price_value: Optional[int] = None
+    rooms: Optional[int] = None
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS listings (
+    id TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    city TEXT,
+    title TEXT NOT NULL,
+    price TEXT NOT NULL,
+    price_value INTEGER,
+    rooms INTEGER,
+    url TEXT NOT NULL,
+    scraped_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS listings_source ON listings (source);
+CREATE INDEX IF NOT EXISTS listings_city ON listings (city);
+CREATE INDEX IF NOT EXISTS listings_price ON listings (price_value);
+CREATE INDEX IF NOT EXISTS listings_city_rooms ON listings (city, rooms);
+
+CREATE TABLE IF NOT EXISTS subscriptions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    city TEXT NOT NULL,
+    rooms INTEGER,
+    max_price INTEGER
+);
+CREATE UNIQUE INDEX IF NOT EXISTS subscriptions_unique
+    ON subscriptions (user_id, city, IFNULL(rooms, -1), IFNULL(max_price, -1));
+CREATE INDEX IF NOT EXISTS subscriptions_city ON subscriptions (city);
+"""
+
+class SubscriptionIndex:
+    """Подписки, сгруппированные по (город, комнаты) и отсортированные по max_price.
+    
+    Для объявления просматриваются две корзины города: с любым числом комнат и
+    с числом комнат объявления. В каждой берутся подписчики без ограничения
+    цены и, бинарным поиском по отсортированным max_price, все подписчики с
+    max_price не ниже цены объявления.
+    """
+    
+    def __init__(self):
+        self.buckets: Dict[tuple, Dict] = {}
+        self.rooms_by_city: Dict[str, Set[Optional[int]]] = {}
+    
+    def _bucket(self, city: str, rooms: Optional[int]) -> Dict:
+        key = (city, rooms)
+        if key not in self.buckets:
+            self.buckets[key] = {'unlimited': set(), 'prices': [], 'users': {}}
+            self.rooms_by_city.setdefault(city, set()).add(rooms)
+        return self.buckets[key]
+    
+    def add(self, subscription: Subscription):
+        bucket = self._bucket(subscription.city, subscription.rooms)
+        if subscription.max_price is None:
+            bucket['unlimited'].add(subscription.user_id)
+            return
+        if subscription.max_price not in bucket['users']:
+            bisect.insort(bucket['prices'], subscription.max_price)
+            bucket['users'][subscription.max_price] = set()
+        bucket['users'][subscription.max_price].add(subscription.user_id)
+    
+    def remove(self, subscription: Subscription):
+        key = (subscription.city, subscription.rooms)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            return
+        if subscription.max_price is None:
+            bucket['unlimited'].discard(subscription.user_id)
+        elif subscription.max_price in bucket['users']:
+            users = bucket['users'][subscription.max_price]
+            users.discard(subscription.user_id)
+            if not users:
+                del bucket['users'][subscription.max_price]
+                del bucket['prices'][bisect.bisect_left(bucket['prices'], subscription.max_price)]
+        if not bucket['unlimited'] and not bucket['users']:
+            del self.buckets[key]
+            city_rooms = self.rooms_by_city[subscription.city]
+            city_rooms.discard(subscription.rooms)
+            if not city_rooms:
+                del self.rooms_by_city[subscription.city]
+    
+    def cities(self) -> List[str]:
+        return list(self.rooms_by_city)
+    
+    def city_filters(self, city: str) -> Dict[Optional[int], tuple]:
+        """Для каждой корзины города: (наибольший max_price или None без ограничения, число подписок)"""
+        filters = {}
+        for rooms in self.rooms_by_city.get(city, ()):
+            bucket = self.buckets[(city, rooms)]
+            count = len(bucket['unlimited']) + sum(len(users) for users in bucket['users'].values())
+            filters[rooms] = (None if bucket['unlimited'] else bucket['prices'][-1], count)
+        return filters
+    
+    def match(self, listing: Listing) -> Set[int]:
+        if listing.source != 'yandex' or listing.city is None:
+            return set()
+        keys = [(listing.city, None)]
+        if listing.rooms is not None:
+            keys.append((listing.city, listing.rooms))
+        groups = []
+        for key in keys:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                continue
+            groups.append(bucket['unlimited'])
+            if listing.price_value is not None:
+                prices = bucket['prices']
+                users = bucket['users']
+                groups.extend(users[max_price] for max_price in prices[bisect.bisect_left(prices, listing.price_value):])
+        return set().union(*groups)
+
+
+class ScrapePlan:
+    """Наименьший набор запросов (город, комнаты, max_price), покрывающий все подписки.
+    
+    В каждом городе корзина SubscriptionIndex сворачивается в один запрос с
+    наибольшим max_price корзины, а запрос с любым числом комнат поглощает
+    запросы корзин с конкретным числом комнат, если его потолок цены не ниже.
+    План хранится по городам; при изменении подписки пересчитывается только
+    ее город. Если запросов больше max_queries, города с несколькими
+    запросами сворачиваются в один запрос без фильтра комнат, а если не
+    хватает и этого, остаются города с наибольшим числом подписок.
+    """
+    
+    def __init__(self, max_queries: Optional[int] = None):
+        self.max_queries = max_queries
+        self.by_city: Dict[str, tuple] = {}
+    
+    @staticmethod
+    def _covers(max_price: Optional[int], other: Optional[int]) -> bool:
+        return max_price is None or (other is not None and other <= max_price)
+    
+    def update_city(self, index: SubscriptionIndex, city: str):
+        filters = index.city_filters(city)
+        if not filters:
+            self.by_city.pop(city, None)
+            return
+        broad = filters.get(None)
+        queries = [
+            (city, rooms, max_price)
+            for rooms, (max_price, _) in sorted(filters.items(), key=lambda item: -1 if item[0] is None else item[0])
+            if rooms is None or broad is None or not self._covers(broad[0], max_price)
+        ]
+        self.by_city[city] = (sum(count for _, count in filters.values()), queries)
+    
+    def rebuild(self, index: SubscriptionIndex):
+        self.by_city = {}
+        for city in index.cities():
+            self.update_city(index, city)
+    
+    def queries(self) -> List[tuple]:
+        ranked = sorted(self.by_city.items(), key=lambda item: -item[1][0])
+        plan = {city: queries for city, (_, queries) in ranked}
+        total = sum(len(queries) for queries in plan.values())
+        if self.max_queries is not None and total > self.max_queries:
+            for city in sorted(plan, key=lambda city: -len(plan[city])):
+                if total <= self.max_queries or len(plan[city]) == 1:
+                    break
+                prices = [max_price for _, _, max_price in plan[city]]
+                total -= len(prices) - 1
+                plan[city] = [(city, None, None if None in prices else max(prices))]
+            if total > self.max_queries:
+                plan = dict(list(plan.items())[:self.max_queries])
+        return [query for queries in plan.values() for query in queries]
+
+
+MAX_WRITE_BACKOFF = 30.0
+# PRAGMA user_version базы после переноса данных из JSON
+JSON_MIGRATED_VERSION = 1
+
+INSERT_LISTING = """
+{verb} INTO listings (id, source, city, title, price, price_value, rooms, url, scraped_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
 
 
 class Database:
+    """Объявления и подписки в SQLite (WAL).
+    
+    Все запросы выполняются в одном отдельном потоке со своим соединением:
+    цикл событий не блокируется, а записи от разных обработчиков бота
+    выполняются по очереди, каждая пачка - одной транзакцией.
+    
+    Подписки читаются из базы один раз и дальше обслуживаются из памяти
+    (по user_id и в SubscriptionIndex для поиска подписчиков объявления). Изменения сразу применяются в памяти
+    и ставятся в очередь задачи-писателя, которая сохраняет их пачками
+    не чаще раза в write_delay секунд. Слушатели из add_subscription_listener
+    вызываются после каждого изменения с индексом и городом подписки (None -
+    изменились все).
+    """
     
-    def __init__(self, data_dir: Path = Path("data")):
+    def __init__(self, data_dir: Path = Path("data"), write_delay: float = 0.2):
         self.data_dir = data_dir
         self.data_dir.mkdir(parents=True, exist_ok=True)
+        self.db_file = self.data_dir / "bot.db"
         self.listings_file = self.data_dir / "listings.json"
         self.subscriptions_file = self.data_dir / "subscriptions.json"
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="database")
+        self._conn: Optional[sqlite3.Connection] = None
+        self.write_delay = write_delay
+        self._subs_by_user: Optional[Dict[int, List[Subscription]]] = None
+        self._index = SubscriptionIndex()
+        self._cache_lock = asyncio.Lock()
+        self._pending_writes: Optional[asyncio.Queue] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        self._listeners: List[Callable[[SubscriptionIndex, Optional[str]], None]] = []
     
-    async def load_listings(self) -> Dict[str, Listing]:
-        if not self.listings_file.exists():
-            return {}
-        
-        try:
-            async with aiofiles.open(self.listings_file, 'r', encoding='utf-8') as f:
-                content = await f.read()
-                data = json.loads(content)
-                return {listing_id: Listing(**listing) for listing_id, listing in data.items()}
-        except Exception as e:
-            print(f"Ошибка при загрузке объявлений: {e}")
-            return {}
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_file, isolation_level=None)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.executescript(SCHEMA)
+                if conn.execute("PRAGMA user_version").fetchone()[0] < JSON_MIGRATED_VERSION:
+                    self._migrate_json(conn)
+            except BaseException:
+                conn.close()
+                raise
+            self._conn = conn
+        return self._conn
     
-    async def save_listings(self, listings: Dict[str, Listing]) -> None:
-        data = {listing_id: asdict(listing) for listing_id, listing in listings.items()}
-        async with aiofiles.open(self.listings_file, 'w', encoding='utf-8') as f:
-            await f.write(json.dumps(data, ensure_ascii=False, indent=2))
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: func(self._connect(), *args))
     
-    async def add_listings(self, new_listings: List[Listing]) -> List[Listing]:
-        existing = await self.load_listings()
-        truly_new = []
+    async def close(self) -> None:
+        await self.flush()
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            await asyncio.gather(self._writer_task, return_exceptions=True)
+            self._writer_task = None
         
-        for listing in new_listings:
-            if listing.id not in existing:
-                existing[listing.id] = listing
-                truly_new.append(listing)
+        def close_connection(conn: sqlite3.Connection):
+            conn.close()
+            self._conn = None
         
-        if truly_new:
-            await self.save_listings(existing)
-        
-        return truly_new
+        if self._conn is not None:
+            await self._run(close_connection)
+        self._executor.shutdown(wait=True)
     
-    async def load_subscriptions(self) -> List[Subscription]:
-        if not self.subscriptions_file.exists():
+    @staticmethod
+    def _read_legacy(path: Path, parse) -> list:
+        """Записи прежнего JSON файла; испорченный файл переименовывается в *.bad и пропускается"""
+        if not path.exists():
             return []
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return parse(json.load(f))
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            bad_path = path.with_name(path.name + '.bad')
+            print(f"Ошибка при переносе данных из {path}: {e}; файл переименован в {bad_path}")
+            os.replace(path, bad_path)
+            return []
+    
+    def _migrate_json(self, conn: sqlite3.Connection):
+        """Перенос данных из прежних listings.json и subscriptions.json одной транзакцией.
         
+        Завершение отмечается в PRAGMA user_version той же транзакцией: после
+        сбоя перенос повторяется при следующем подключении.
+        """
+        listings = self._read_legacy(self.listings_file, lambda data: [Listing(**listing) for listing in data.values()])
+        subscriptions = self._read_legacy(self.subscriptions_file, lambda data: [Subscription(**sub) for sub in data])
+        sql = INSERT_LISTING.format(verb="INSERT OR IGNORE")
+        statements = [(sql, self._listing_row(listing)) for listing in listings]
+        statements.extend(
+            ("INSERT OR IGNORE INTO subscriptions (user_id, city, rooms, max_price) VALUES (?, ?, ?, ?)",
+             (sub.user_id, sub.city, sub.rooms, sub.max_price))
+            for sub in subscriptions
+        )
+        statements.append((f"PRAGMA user_version = {JSON_MIGRATED_VERSION}", ()))
+        self._transaction(conn, statements)
+    
+    @staticmethod
+    def _transaction(conn: sqlite3.Connection, statements) -> list:
+        """Выполнить (sql, параметры) одной транзакцией; вернуть rowcount каждого"""
+        counts = []
+        conn.execute("BEGIN IMMEDIATE")
         try:
-            async with aiofiles.open(self.subscriptions_file, 'r', encoding='utf-8') as f:
-                content = await f.read()
-                data = json.loads(content)
-                return [Subscription(**sub) for sub in data]
-        except Exception as e:
-            print(f"Ошибка при загрузке подписок: {e}")
+            for sql, params in statements:
+                counts.append(conn.execute(sql, params).rowcount)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return counts
+    
+    @staticmethod
+    def _listing_row(listing: Listing) -> tuple:
+        return (listing.id, listing.source, listing.city, listing.title, listing.price,
+                listing.price_value, listing.rooms, listing.url, listing.scraped_at)
+    
+    @classmethod
+    def _insert_listings(cls, conn: sqlite3.Connection, listings: List[Listing], replace: bool = False) -> List[Listing]:
+        sql = INSERT_LISTING.format(verb="INSERT OR REPLACE" if replace else "INSERT OR IGNORE")
+        counts = cls._transaction(conn, ((sql, cls._listing_row(listing)) for listing in listings))
+        return [listing for listing, count in zip(listings, counts) if count == 1]
+    
+    @staticmethod
+    def _select_listings(conn: sqlite3.Connection) -> Dict[str, Listing]:
+        rows = conn.execute("SELECT id, source, title, price, url, scraped_at, city, price_value, rooms FROM listings")
+        return {row[0]: Listing(*row) for row in rows}
+    
+    @staticmethod
+    def _select_subscriptions(conn: sqlite3.Connection) -> List[Subscription]:
+        rows = conn.execute("SELECT user_id, city, rooms, max_price FROM subscriptions ORDER BY id")
+        return [Subscription(*row) for row in rows]
+    
+    @classmethod
+    def _apply_subscription_ops(cls, conn: sqlite3.Connection, ops: List[tuple]):
+        statements = []
+        for op, payload in ops:
+            if op == 'replace':
+                statements.append(("DELETE FROM subscriptions", ()))
+                subscriptions = payload
+                op = 'add'
+            else:
+                subscriptions = [payload]
+            for sub in subscriptions:
+                params = (sub.user_id, sub.city, sub.rooms, sub.max_price)
+                if op == 'add':
+                    statements.append(
+                        ("INSERT OR IGNORE INTO subscriptions (user_id, city, rooms, max_price) VALUES (?, ?, ?, ?)", params)
+                    )
+                else:
+                    statements.append((
+                        "DELETE FROM subscriptions WHERE user_id = ? AND city = ? "
+                        "AND IFNULL(rooms, -1) = IFNULL(?, -1) AND IFNULL(max_price, -1) = IFNULL(?, -1)",
+                        params
+                    ))
+        cls._transaction(conn, statements)
+    
+    async def _subscriptions(self) -> Dict[int, List[Subscription]]:
+        if self._subs_by_user is None:
+            async with self._cache_lock:
+                if self._subs_by_user is None:
+                    self._rebuild_cache(await self._run(self._select_subscriptions))
+        return self._subs_by_user
+    
+    def _rebuild_cache(self, subscriptions: List[Subscription]):
+        self._subs_by_user = {}
+        self._index = SubscriptionIndex()
+        for sub in subscriptions:
+            self._cache_add(sub)
+    
+    def _cache_add(self, subscription: Subscription):
+        self._subs_by_user.setdefault(subscription.user_id, []).append(subscription)
+        self._index.add(subscription)
+    
+    def _cache_remove(self, subscription: Subscription):
+        user_subs = self._subs_by_user[subscription.user_id]
+        user_subs.remove(subscription)
+        if not user_subs:
+            del self._subs_by_user[subscription.user_id]
+        self._index.remove(subscription)
+    
+    def add_subscription_listener(self, callback: Callable[[SubscriptionIndex, Optional[str]], None]):
+        self._listeners.append(callback)
+    
+    def _notify(self, city: Optional[str]):
+        for callback in self._listeners:
+            try:
+                callback(self._index, city)
+            except Exception as e:
+                print(f"Ошибка в обработчике изменения подписок: {e}")
+    
+    async def subscription_index(self) -> SubscriptionIndex:
+        await self._subscriptions()
+        return self._index
+    
+    def _enqueue_write(self, op: str, payload):
+        if self._pending_writes is None:
+            self._pending_writes = asyncio.Queue()
+        if self._writer_task is None or self._writer_task.done():
+            self._writer_task = asyncio.create_task(self._subscription_writer())
+        self._pending_writes.put_nowait((op, payload))
+    
+    async def _subscription_writer(self):
+        """Единственный писатель подписок: копит изменения write_delay секунд и пишет их одной транзакцией.
+        
+        Неудачная транзакция повторяется с растущей паузой (до MAX_WRITE_BACKOFF
+        секунд) вместе с изменениями, пришедшими за это время, поэтому кэш в
+        памяти не расходится с базой, а flush() ждет настоящей записи.
+        """
+        queue = self._pending_writes
+        while True:
+            ops = [await queue.get()]
+            await asyncio.sleep(self.write_delay)
+            delay = self.write_delay
+            while True:
+                while not queue.empty():
+                    ops.append(queue.get_nowait())
+                try:
+                    await self._run(self._apply_subscription_ops, ops)
+                    break
+                except Exception as e:
+                    delay = min(delay * 2, MAX_WRITE_BACKOFF)
+                    print(f"Ошибка при сохранении подписок, повтор через {delay:.1f} сек: {e}")
+                    await asyncio.sleep(delay)
+            for _ in ops:
+                queue.task_done()
+    
+    async def flush(self) -> None:
+        """Дождаться сохранения всех изменений подписок"""
+        if self._pending_writes is not None:
+            await self._pending_writes.join()
+    
+    async def match_listings(self, listings: List[Listing]) -> List[tuple]:
+        """Пары (объявление, множество user_id подписчиков) для объявлений, у которых есть подписчики"""
+        await self._subscriptions()
+        matches = []
+        for listing in listings:
+            users = self._index.match(listing)
+            if users:
+                matches.append((listing, users))
+        return matches
+    
+    async def load_listings(self) -> Dict[str, Listing]:
+        return await self._run(self._select_listings)
+    
+    async def save_listings(self, listings: Dict[str, Listing]) -> None:
+        await self._run(self._insert_listings, list(listings.values()), True)
+    
+    async def add_listings(self, new_listings: List[Listing]) -> List[Listing]:
+        if not new_listings:
             return []
+        return await self._run(self._insert_listings, new_listings)
+    
+    async def load_subscriptions(self) -> List[Subscription]:
+        return [sub for user_subs in (await self._subscriptions()).values() for sub in user_subs]
     
     async def save_subscriptions(self, subscriptions: List[Subscription]) -> None:
-        data = [asdict(sub) for sub in subscriptions]
-        async with aiofiles.open(self.subscriptions_file, 'w', encoding='utf-8') as f:
-            await f.write(json.dumps(data, ensure_ascii=False, indent=2))
+        await self._subscriptions()
+        self._rebuild_cache([])
+        for sub in subscriptions:
+            if sub not in self._subs_by_user.get(sub.user_id, []):
+                self._cache_add(sub)
+        self._enqueue_write('replace', list(subscriptions))
+        self._notify(None)
     
     async def add_subscription(self, subscription: Subscription) -> bool:
-        subscriptions = await self.load_subscriptions()
-        
-        for sub in subscriptions:
-            if (sub.user_id == subscription.user_id and
-                sub.city == subscription.city and
-                sub.rooms == subscription.rooms and
-                sub.max_price == subscription.max_price):
-                return False
-        
-        subscriptions.append(subscription)
-        await self.save_subscriptions(subscriptions)
+        if subscription in (await self._subscriptions()).get(subscription.user_id, []):
+            return False
+        self._cache_add(subscription)
+        self._enqueue_write('add', subscription)
+        self._notify(subscription.city)
         return True
     
     async def remove_subscription(self, user_id: int, index: int) -> bool:
-        subscriptions = await self.load_subscriptions()
-        user_subs = [s for s in subscriptions if s.user_id == user_id]
-        
-        if 0 <= index < len(user_subs):
-            sub_to_remove = user_subs[index]
-            subscriptions.remove(sub_to_remove)
-            await self.save_subscriptions(subscriptions)
-            return True
-        return False
+        user_subs = (await self._subscriptions()).get(user_id, [])
+        if not 0 <= index < len(user_subs):
+            return False
+        subscription = user_subs[index]
+        self._cache_remove(subscription)
+        self._enqueue_write('remove', subscription)
+        self._notify(subscription.city)
+        return True
     
     async def get_user_subscriptions(self, user_id: int) -> List[Subscription]:
-        subscriptions = await self.load_subscriptions()
-        return [s for s in subscriptions if s.user_id == user_id]
+        return list((await self._subscriptions()).get(user_id, []))
     
     def matches_subscription(self, listing: Listing, subscription: Subscription) -> bool:
-        if listing.source != 'yandex':
+        if listing.source != 'yandex' or listing.city != subscription.city:
+            return False
+        if subscription.rooms is not None and listing.rooms != subscription.rooms:
+            return False
+        if subscription.max_price is not None and (listing.price_value is None or listing.price_value > subscription.max_price):
             return False
         return True
 
 
+MAX_MESSAGE_LENGTH = 4096
+MAX_LISTINGS_PER_MESSAGE = 10
+MAX_SEND_ATTEMPTS = 5
+
+
+class TokenBucket:
+    """rate токенов в секунду, не больше capacity; pause() останавливает выдачу на время"""
+    
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+    
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if now >= self.blocked_until and self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep(max(self.blocked_until - now, (1 - self.tokens) / self.rate))
+    
+    def pause(self, delay: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+        self.tokens = 0
+    
+    def idle(self) -> bool:
+        now = time.monotonic()
+        return now >= self.blocked_until and self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+def format_listings(listings: List[Listing]) -> List[str]:
+    """Тексты сообщений: одно объявление - прежний формат, несколько - списком до MAX_LISTINGS_PER_MESSAGE в сообщении"""
+    if len(listings) == 1:
+        listing = listings[0]
+        return [
+            f"Новое объявление!\n\n"
+            f"{listing.title}\n"
+            f"Цена: {listing.price}\n"
+            f"Ссылка: {listing.url}\n"
+            f"Дата: {listing.scraped_at}"
+        ]
+    
+    messages = []
+    for start in range(0, len(listings), MAX_LISTINGS_PER_MESSAGE):
+        chunk = listings[start:start + MAX_LISTINGS_PER_MESSAGE]
+        text = f"Новых объявлений: {len(chunk)}\n"
+        for listing in chunk:
+            entry = f"\n{listing.title}\nЦена: {listing.price}\n{listing.url}\n"
+            if len(text) + len(entry) > MAX_MESSAGE_LENGTH:
+                messages.append(text)
+                text = ""
+            text += entry
+        messages.append(text)
+    return messages
+
+
+class NotificationSender:
+    """Пул из workers задач, отправляющих сообщения в пределах лимитов Telegram.
+    
+    Общий лимит бота (global_rate сообщений в секунду) и лимит на чат
+    (chat_rate) - корзины токенов; сначала ждем токен чата, потом общий.
+    Ответ 429 останавливает общую корзину на retry_after, и сообщение
+    отправляется повторно.
+    """
+    
+    def __init__(self, bot: Bot, workers: int = 16, global_rate: float = 30.0, chat_rate: float = 1.0):
+        self.bot = bot
+        self.workers = workers
+        self.global_bucket = TokenBucket(global_rate, 1)
+        self.chat_rate = chat_rate
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+    
+    async def _send(self, user_id: int, text: str) -> bool:
+        chat_bucket = self.chat_buckets.setdefault(user_id, TokenBucket(self.chat_rate, 1))
+        for attempt in range(MAX_SEND_ATTEMPTS):
+            await chat_bucket.acquire()
+            await self.global_bucket.acquire()
+            # лимит чата считается от момента отправки, а не от получения токена
+            chat_bucket.updated = time.monotonic()
+            try:
+                await self.bot.send_message(user_id, text)
+                return True
+            except TelegramRetryAfter as e:
+                self.global_bucket.pause(e.retry_after)
+                chat_bucket.pause(e.retry_after)
+            except Exception as e:
+                print(f"Ошибка при отправке сообщения пользователю {user_id}: {e}")
+                return False
+        print(f"Сообщение пользователю {user_id} не отправлено после {MAX_SEND_ATTEMPTS} попыток")
+        return False
+    
+    async def _worker(self, jobs: asyncio.Queue, stats: Dict[str, int]):
+        while True:
+            user_id, texts = await jobs.get()
+            try:
+                for text in texts:
+                    stats['sent' if await self._send(user_id, text) else 'failed'] += 1
+            finally:
+                jobs.task_done()
+    
+    async def send_all(self, listings_by_user: Dict[int, List[Listing]]) -> Dict[str, int]:
+        """Отправить каждому пользователю его объявления; сообщения одного пользователя идут по порядку"""
+        stats = {'sent': 0, 'failed': 0}
+        jobs: asyncio.Queue = asyncio.Queue()
+        for user_id, listings in listings_by_user.items():
+            jobs.put_nowait((user_id, format_listings(listings)))
+        
+        workers = [asyncio.create_task(self._worker(jobs, stats)) for _ in range(min(self.workers, jobs.qsize()))]
+        try:
+            await jobs.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            self.chat_buckets = {user_id: bucket for user_id, bucket in self.chat_buckets.items() if not bucket.idle()}
+        return stats
+
+
 class TelegramBot:
     
     def __init__(self, token: str, db: Database):
         self.bot = Bot(token=token)
         self.dp = Dispatcher()
         self.db = db
+        self.sender = NotificationSender(self.bot)
         self._register_handlers()
     
     def _register_handlers(self):
@@ -260,27 +766,19 @@ class TelegramBot:
             await message.answer("Номер должен быть числом!")
     
     async def send_listing_notification(self, user_id: int, listing: Listing):
-        text = (
-            f"Новое объявление!\n\n"
-            f"{listing.title}\n"
-            f"Цена: {listing.price}\n"
-            f"Ссылка: {listing.url}\n"
-            f"Дата: {listing.scraped_at}"
-        )
-        
-        try:
-            await self.bot.send_message(user_id, text)
-        except Exception as e:
-            print(f"Ошибка при отправке сообщения пользователю {user_id}: {e}")
+        await self.sender.send_all({user_id: [listing]})
     
     async def process_new_listings(self, new_listings: List[Listing]):
-        subscriptions = await self.db.load_subscriptions()
+        listings_by_user: Dict[int, List[Listing]] = {}
+        for listing, user_ids in await self.db.match_listings(new_listings):
+            for user_id in user_ids:
+                listings_by_user.setdefault(user_id, []).append(listing)
         
-        for listing in new_listings:
-            for subscription in subscriptions:
-                if self.db.matches_subscription(listing, subscription):
-                    await self.send_listing_notification(subscription.user_id, listing)
-                    await asyncio.sleep(0.1)
+        if listings_by_user:
+            start_time = time.perf_counter()
+            stats = await self.sender.send_all(listings_by_user)
+            print(f"Уведомления: отправлено {stats['sent']}, с ошибкой {stats['failed']} "
+                  f"за {time.perf_counter() - start_time:.1f} секунд")
     
     async def start(self):
         await self.dp.start_polling(self.bot)
@@ -291,23 +789,62 @@ async def run_bot_and_scraper(
     scrape_interval: int = 3600,
     city: str = "moskva",
     rooms: Optional[int] = None,
-    max_price: Optional[int] = None
+    max_price: Optional[int] = None,
+    min_interval: Optional[int] = None,
+    max_queries: Optional[int] = 20,
+    max_pages: int = 5,
+    concurrency: int = 8,
+    rate: float = 5.0
 ):
+    """Бот и скрапер; скрапер проверяет запросы, покрывающие подписки пользователей.
+    
+    Пока подписок нет, проверяется запрос city/rooms/max_price. За одну проверку
+    делается не больше max_queries * max_pages запросов к сайту.
+    """
     import sys
     from pathlib import Path
     sys.path.insert(0, str(Path(__file__).parent))
-    from task_5_2 import RentalScraper
+    from task_5_2 import RentalScraper, SearchQuery
+    from scrape_scheduler import AdaptiveScheduler
     
     db = Database()
     bot = TelegramBot(bot_token, db)
     
     async def scraper_loop():
-        async with RentalScraper() as scraper:
+        async with RentalScraper(max_pages=max_pages, concurrency=concurrency, rate=rate) as scraper:
+            scheduler = AdaptiveScheduler(
+                min_interval=scrape_interval if min_interval is None else min_interval,
+                max_interval=scrape_interval,
+                state_path=scraper.output_dir / "schedule.json"
+            )
+            plan = ScrapePlan(max_queries)
+            default_query = SearchQuery(city, rooms, max_price)
+            
+            def replan(index: SubscriptionIndex, changed_city: Optional[str]):
+                if changed_city is None:
+                    plan.rebuild(index)
+                else:
+                    plan.update_city(index, changed_city)
+                wanted = {SearchQuery(*query) for query in plan.queries()} or {default_query}
+                current = set(scheduler.queries())
+                for query in current - wanted:
+                    scheduler.remove(query)
+                for query in wanted - current:
+                    scheduler.add(query, delay=0 if not current else None)
+                if wanted != current:
+                    print(f"План скрапинга: {len(wanted)} запросов (+{len(wanted - current)}, -{len(current - wanted)})")
+            
+            replan(await db.subscription_index(), None)
+            db.add_subscription_listener(replan)
+            
             while True:
+                due_queries = await scheduler.next_batch()
+                new_by_query = {}
                 try:
                     print(f"\n[{datetime.now()}] Начинаем проверку новых объявлений...")
                     
-                    new_listings_raw = await scraper.find_new_listings(city, rooms, max_price)
+                    new_by_query, page_updates = await scraper.find_new_listings_by_query(due_queries)
+                    new_listings_raw = [listing for query in due_queries for listing in new_by_query.get(query, [])]
                     
                     new_listings = [
                         Listing(
@@ -316,31 +853,43 @@ async def run_bot_and_scraper(
                             title=listing['title'],
                             price=listing['price'],
                             url=listing['url'],
-                            scraped_at=listing['scraped_at']
+                            scraped_at=listing['scraped_at'],
+                            city=listing.get('city'),
+                            price_value=listing.get('price_value'),
+                            rooms=listing.get('rooms')
                         )
                         for listing in new_listings_raw
                     ]
                     
+                    truly_new = []
                     if new_listings:
                         print(f"Найдено {len(new_listings)} новых объявлений")
                         truly_new = await db.add_listings(new_listings)
-                        
-                        if truly_new:
-                            print(f"Добавлено {len(truly_new)} новых объявлений в базу")
-                            await bot.process_new_listings(truly_new)
+                        scraper.mark_seen(new_listings_raw)
                     else:
                         print("Новых объявлений не найдено")
+                    # страницы запоминаются только после записи их объявлений в базу
+                    scraper.commit_pages(page_updates)
                     
-                    print(f"Следующая проверка через {scrape_interval} секунд...")
+                    if truly_new:
+                        print(f"Добавлено {len(truly_new)} новых объявлений в базу")
+                        await bot.process_new_listings(truly_new)
                 except Exception as e:
                     print(f"Ошибка в цикле скрапинга: {e}")
                 
-                await asyncio.sleep(scrape_interval)
+                for query in due_queries:
+                    next_check = scheduler.record(query, len(new_by_query.get(query, [])))
+                    print(f"Следующая проверка {query} через {next_check:.0f} секунд...")
+                scheduler.save()
     
-    await asyncio.gather(
-        bot.start(),
-        scraper_loop()
-    )
+    try:
+        await asyncio.gather(
+            bot.start(),
+            scraper_loop()
+        )
+    finally:
+        # подписки, подтвержденные пользователям, но еще не записанные в базу
+        await db.close()
 
 
 def main():
@@ -359,7 +908,7 @@ def main():
         "--city",
         type=str,
         default="moskva",
-        help="Город для скрапинга (по умолчанию: moskva)"
+        help="Город для скрапинга, пока нет подписок (по умолчанию: moskva)"
     )
     parser.add_argument(
         "--rooms",
@@ -377,7 +926,37 @@ def main():
         "--interval",
         type=int,
         default=3600,
-        help="Интервал между проверками в секундах (по умолчанию: 3600)"
+        help="Максимальный интервал между проверками в секундах (по умолчанию: 3600)"
+    )
+    parser.add_argument(
+        "--min-interval",
+        type=int,
+        default=120,
+        help="Минимальный интервал между проверками в секундах (по умолчанию: 120)"
+    )
+    parser.add_argument(
+        "--max-queries",
+        type=int,
+        default=20,
+        help="Максимальное число запросов скрапера по подпискам (по умолчанию: 20)"
+    )
+    parser.add_argument(
+        "--pages",
+        type=int,
+        default=5,
+        help="Максимальное число страниц на запрос (по умолчанию: 5)"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=8,
+        help="Число одновременных запросов страниц (по умолчанию: 8)"
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=5.0,
+        help="Запросов в секунду к сайту (по умолчанию: 5)"
     )
     
     args = parser.parse_args()
@@ -395,7 +974,12 @@ def main():
         args.interval,
         args.city,
         args.rooms,
-        args.max_price
+        args.max_price,
+        args.min_interval,
+        args.max_queries,
+        args.pages,
+        args.concurrency,
+        args.rate
     ))
 
 
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+import asyncio
+import hashlib
+import random
+import tempfile
+import time
+from email.utils import formatdate
+from pathlib import Path
+
+from listing_store import ListingStore
+from scrape_scheduler import AdaptiveScheduler
+from seen_index import BloomFilter, SeenIndex
+from task_5_1 import parse_retry_after
+from task_5_2 import RentalScraper, available_backends, parse_price, parse_yandex_listings
+from task_5_3 import Database, Listing, ScrapePlan, Subscription, SubscriptionIndex
+
+
+def test_parse_price():
+    assert parse_price("45 000 ₽/мес.") == 45000
+    assert parse_price("45 000 ₽") == 45000
+    assert parse_price("7000 ₽") == 7000
+
+
+def test_parse_price_extra_amounts():
+    assert parse_price("45 000 ₽ + КУ 3 000 ₽") == 45000
+    assert parse_price("от 30 000 до 45 000 ₽") == 30000
+
+
+def test_parse_price_multiplier():
+    assert parse_price("1,2 млн ₽") == 1200000
+    assert parse_price("1 млн ₽") == 1000000
+
+
+def test_parse_price_missing():
+    assert parse_price("Цена договорная") is None
+    assert parse_price("") is None
+    assert parse_price(None) is None
+
+
+def test_subscription_index_matches_brute_force():
+    rng = random.Random(48)
+    cities = ["moskva", "spb", "kazan"]
+    db = Database(Path(tempfile.mkdtemp()))
+    subscriptions = [
+        Subscription(user_id, rng.choice(cities), rng.choice([None, 0, 1, 2, 3]), rng.choice([None, 30000, 45000, 60000]))
+        for user_id in range(300)
+    ]
+    index = SubscriptionIndex()
+    for sub in subscriptions:
+        index.add(sub)
+    removed = rng.sample(subscriptions, 50)
+    for sub in removed:
+        index.remove(sub)
+    active = [sub for sub in subscriptions if sub not in removed]
+    
+    for i in range(2000):
+        listing = Listing(
+            id=str(i), source=rng.choice(["yandex", "yandex", "avito"]), title="", price="", url="", scraped_at="",
+            city=rng.choice(cities + [None]), price_value=rng.choice([None, 20000, 30000, 45001, 60000, 90000]),
+            rooms=rng.choice([None, 0, 1, 2, 3])
+        )
+        expected = {sub.user_id for sub in active if db.matches_subscription(listing, sub)}
+        assert index.match(listing) == expected
+
+
+def test_listing_store_repairs_torn_tail():
+    for compress in (False, True):
+        root = Path(tempfile.mkdtemp())
+        store = ListingStore(root, compress=compress)
+        store.append([{'id': str(i)} for i in range(3)])
+        store.append([{'id': str(i)} for i in range(3, 6)])
+        path = store.segments()[-1][1]
+        with open(path, 'r+b') as f:
+            f.truncate(path.stat().st_size - 5)
+        
+        store = ListingStore(root, compress=compress)
+        store.append([{'id': str(i)} for i in range(6, 9)])
+        ids = [record['id'] for record in store.iter_records()]
+        assert ids[:3] == ['0', '1', '2']
+        assert ids[-3:] == ['6', '7', '8']
+
+
+def test_listing_store_compact():
+    store = ListingStore(Path(tempfile.mkdtemp()), max_segment_bytes=1)
+    for batch in (['a', 'b'], ['b', 'c'], ['a', 'd'], ['e']):
+        store.append([{'id': listing_id, 'batch': len(store.segments())} for listing_id in batch])
+    assert len(store.segments()) == 4
+    
+    assert store.compact() == (6, 4)
+    assert len(store.segments()) == 2
+    records = list(store.iter_records())
+    assert [record['id'] for record in records] == ['a', 'b', 'c', 'd', 'e']
+    assert [record['batch'] for record in records if record['id'] in ('a', 'b')] == [0, 0]
+
+
+def test_seen_index_truncates_torn_record():
+    path = Path(tempfile.mkdtemp()) / "seen_ids.bin"
+    index = SeenIndex(path)
+    ids = [hashlib.md5(str(i).encode()).hexdigest() for i in range(10)] + ["не md5"]
+    assert index.add_many(ids) == 11
+    assert index.add_many(ids[:3]) == 0
+    with open(path, 'ab') as f:
+        f.write(b'\x01' * 7)
+    
+    index = SeenIndex(path)
+    assert len(index) == 11
+    assert path.stat().st_size == 11 * 16
+    assert all(listing_id in index for listing_id in ids)
+    assert "другой" not in index
+
+
+def test_seen_index_bloom_filter():
+    path = Path(tempfile.mkdtemp()) / "seen_ids.bin"
+    ids = [f"listing-{i}" for i in range(5000)]
+    SeenIndex(path).add_many(ids)
+    
+    index = SeenIndex(path, bloom_capacity=10000)
+    assert isinstance(index.digests, BloomFilter)
+    assert all(listing_id in index for listing_id in ids)
+    false_positives = sum(f"other-{i}" in index for i in range(5000))
+    assert false_positives <= 1
+
+
+def test_scrape_plan_collapses_filters():
+    index = SubscriptionIndex()
+    for sub in [
+        Subscription(1, "moskva", 2, 50000),
+        Subscription(2, "moskva", 2, 40000),
+        Subscription(3, "moskva", 1, 40000),
+        Subscription(4, "moskva", None, 60000),
+        Subscription(5, "moskva", 3, 90000),
+        Subscription(6, "spb", 1, None),
+        Subscription(7, "spb", 1, 30000),
+    ]:
+        index.add(sub)
+    plan = ScrapePlan()
+    plan.rebuild(index)
+    assert sorted(plan.queries(), key=repr) == sorted([
+        ("moskva", None, 60000),
+        ("moskva", 3, 90000),
+        ("spb", 1, None),
+    ], key=repr)
+    
+    index.remove(Subscription(4, "moskva", None, 60000))
+    plan.update_city(index, "moskva")
+    assert sorted(plan.queries(), key=repr) == sorted([
+        ("moskva", 1, 40000),
+        ("moskva", 2, 50000),
+        ("moskva", 3, 90000),
+        ("spb", 1, None),
+    ], key=repr)
+    
+    plan.max_queries = 2
+    assert sorted(plan.queries(), key=repr) == sorted([("moskva", None, 90000), ("spb", 1, None)], key=repr)
+    plan.max_queries = 1
+    assert plan.queries() == [("moskva", None, 90000)]
+
+
+def test_adaptive_scheduler_intervals_and_order():
+    scheduler = AdaptiveScheduler(min_interval=10, max_interval=1000, target_new=1.0, jitter=0.0)
+    now = time.time()
+    for query in ("fast", "slow", "idle"):
+        scheduler.add(query, delay=0)
+        scheduler.record(query, 0, now=now - 100)
+    
+    assert scheduler.record("fast", 500, now=now) == 10
+    assert scheduler.record("slow", 1, now=now) == 100
+    assert scheduler.record("idle", 0, now=now) == 1000
+    assert scheduler.due["fast"] < scheduler.due["slow"] < scheduler.due["idle"]
+
+
+def test_adaptive_scheduler_next_batch():
+    async def run():
+        scheduler = AdaptiveScheduler(min_interval=0.05, max_interval=0.3, jitter=0.0)
+        for query in ("a", "b", "c"):
+            scheduler.add(query, delay=0)
+        assert sorted(await scheduler.next_batch()) == ["a", "b", "c"]
+        
+        now = time.time()
+        scheduler.record("a", 0, now=now - 10)
+        scheduler.record("a", 100, now=now)
+        scheduler.record("b", 0, now=now)
+        scheduler.remove("c")
+        assert await scheduler.next_batch() == ["a"]
+        assert await scheduler.next_batch() == ["b"]
+        assert scheduler.queries() == ["a", "b"]
+    
+    asyncio.run(run())
+
+
+def test_parser_backends_agree():
+    cards = ''.join(
+        f'<article><div class="OfferCard"><a href="/offer/{i}/"><h3>{i % 4 + 1}-комн. квартира {i}</h3></a>'
+        f'<div class="Price">{i + 30} 000 ₽/мес.</div></div></article>'
+        for i in range(25)
+    )
+    html = (
+        f'<html><body>{cards}'
+        '<a href="/offer/100/"><span data-test="title">Студия</span><span data-test="price">25 000 ₽</span></a>'
+        '<a href="/offer/101/"></a><a href="/offer/1/">повтор</a></body></html>'
+    )
+    fields = ('id', 'title', 'price', 'price_value', 'rooms', 'url')
+    results = {
+        backend: [tuple(listing[field] for field in fields) for listing in parse_yandex_listings(html, backend, None, None)]
+        for backend in available_backends()
+    }
+    reference = results['html.parser']
+    assert len(reference) == 27
+    assert reference[25][1:5] == ('Студия', '25 000 ₽', 25000, 0)
+    assert reference[26][1] == 'Объявление'
+    for listings in results.values():
+        assert listings == reference
+
+
+def test_save_listings_skips_known():
+    scraper = RentalScraper(output_dir=Path(tempfile.mkdtemp()))
+    listings = [{'id': str(i), 'title': f"Квартира {i}"} for i in range(5)]
+    assert scraper.save_listings(listings) is not None
+    assert scraper.save_listings(listings[2:] + [{'id': '5'}, {'id': '5'}]) is not None
+    assert scraper.save_listings(listings) is None
+    assert [listing['id'] for listing in scraper.iter_listings(unique=False)] == ['0', '1', '2', '3', '4', '5']
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("1.5") == 1.5
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("скоро") is None
+    assert 9 <= parse_retry_after(formatdate(time.time() + 10, usegmt=True)) <= 10
+    assert parse_retry_after(formatdate(time.time() - 10, usegmt=True)) == 0.0